@@ -7,27 +7,99 @@
 # Email: nokia-sbell.com
 #
 
-import copy
-
 from path_helper import join, get_base_name
 from vfs import VFs
 
 
 class ArConfig(object):
     def __init__(self):
-        self._list = list()
+        # members shared with the copies of this config, this config has the first `_count` of them
+        self._table = _MemberTable()
+        self._stamp = 0
+        self._count = 0
+        # sorted members, see `get_list`
+        self._sorted = None
 
     def get_list(self):
-        file_list = list()
-        name_list = set()
-        for item in self._list:
-            item_name = get_base_name(item[0])
-            if item_name not in name_list:
-                file_list.append(item)
-        return sorted(file_list)
+        """Return all the members sorted, `ar q` keeps the members of the same base name."""
+        if self._sorted is None:
+            self._sorted = tuple(sorted(self.get_members()))
+        return self._sorted
+
+    def get_members(self):
+        return tuple(self.get_member(i) for i in range(self._count))
+
+    def find_member(self, name):
+        """Return the index of the first member with base name `name`, or -1 if not found."""
+        index = self._table.names.get(name, -1)
+        # the member was added by a copy
+        if index >= self._count:
+            return -1
+        return index
+
+    def get_member(self, index):
+        # the latest version not newer than this config
+        for stamp, file_id in reversed(self._table.members[index]):
+            if stamp <= self._stamp:
+                return file_id
+        raise IndexError('ar: member {:d} not found'.format(index))
+
+    def add_member(self, file_id):
+        self._own_table()
+        table = self._table
+        table.names.setdefault(get_base_name(file_id[0]), len(table.members))
+        table.members.append([(self._stamp, file_id)])
+        self._count += 1
+        self._sorted = None
+
+    def set_member(self, index, file_id):
+        self._own_table()
+        versions = self._table.members[index]
+        if versions[-1][0] == self._stamp:
+            versions[-1] = (self._stamp, file_id)
+        else:
+            versions.append((self._stamp, file_id))
+        self._sorted = None
 
     def copy(self):
-        return copy.deepcopy(self)
+        """Return a copy sharing the member table, O(1)."""
+        config = ArConfig()
+        config._table = self._table
+        config._count = self._count
+        config._sorted = self._sorted
+        if self._stamp == self._table.stamp:
+            # the copy of the latest config becomes the latest
+            self._table.stamp += 1
+            config._stamp = self._table.stamp
+        else:
+            config._stamp = self._stamp
+        return config
+
+    def _own_table(self):
+        # only the latest config changes the table, the others copy their members to a new one
+        if self._stamp == self._table.stamp:
+            return
+        table = _MemberTable()
+        for i in range(self._count):
+            file_id = self.get_member(i)
+            table.names.setdefault(get_base_name(file_id[0]), i)
+            table.members.append([(0, file_id)])
+        self._table = table
+        self._stamp = 0
+
+
+class _MemberTable(object):
+    """Members of the archives of an ArConfig and its copies.
+
+    Each member is a list of (stamp, file id) versions, a config sees the latest version not newer than its stamp.
+    """
+
+    def __init__(self):
+        self.members = list()
+        # base name -> index of the first member with it
+        self.names = dict()
+        # stamp of the latest config
+        self.stamp = 0
 
 
 def run(fs: VFs, target, cmd, cwd, env):
@@ -69,16 +141,16 @@ def run(fs: VFs, target, cmd, cwd, env):
         elif is_new_file:
             config = ArConfig()
         else:
-            config = copy.deepcopy(config)
+            config = config.copy()
         for file_item in cmd[3:]:
             handler = _get_file_handler(fs, cwd, file_item)
             file_id = (handler.get_full_path(), handler.get_version())
-            config._list.append(file_id)
+            config.add_member(file_id)
             modified = True
         if modified and not is_new_file:
             file = fs.create_new_file(cmd[2], cwd)
         file.get_extra_data_ref().value = config
-        return ((file.get_full_path(), file.get_version()),), tuple(config._list)
+        return ((file.get_full_path(), file.get_version()),), config.get_members()
     elif operation == 'r':
         modified = False
         for mod in modifiers:
@@ -93,27 +165,22 @@ def run(fs: VFs, target, cmd, cwd, env):
         elif is_new_file:
             config = ArConfig()
         else:
-            config = copy.deepcopy(config)
+            config = config.copy()
         for file_item in cmd[3:]:
             handler = _get_file_handler(fs, cwd, file_item)
             item_name = handler.get_base_name()
             file_id = (handler.get_full_path(), handler.get_version())
-            found = False
-            for i in range(len(config._list)):
-                if get_base_name(config._list[i][0]) == item_name:
-                    found = True
-                    if 'u' in modifiers and config._list[i][1] >= file_id[1]:
-                        break
-                    modified = True
-                    config._list[i] = file_id
-                    break
-            if not found:
+            index = config.find_member(item_name)
+            if index < 0:
+                modified = True
+                config.add_member(file_id)
+            elif 'u' not in modifiers or config.get_member(index)[1] < file_id[1]:
                 modified = True
-                config._list.append(file_id)
+                config.set_member(index, file_id)
         if modified and not is_new_file:
             file = fs.create_new_file(cmd[2], cwd)
         file.get_extra_data_ref().value = config
-        return ((file.get_full_path(), file.get_version()),), tuple(config._list)
+        return ((file.get_full_path(), file.get_version()),), config.get_members()
     else:
         raise NotImplementedError('ar: not implemented function {:s}'.format(operation))
 
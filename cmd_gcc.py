@@ -9,13 +9,12 @@
 
 import os
 import re
-import copy
 import shlex
 import subprocess
 
 import pygtrie
 import string_helper
-from path_helper import join
+from path_helper import join, get_base_name
 from vfs import VFs
 
 
@@ -38,6 +37,9 @@ class GccConfig(object):
         self._other_options = list()
         self._compile_only = False
         self._generate_dependencies = False
+        # dependency file written by -MD or -MMD, and the option
+        self._dep_file = None
+        self._dep_file_option = None
         self._linker_options = list()
         self._default_include_dirs = list()
         self._default_sys_include_dirs = list()
@@ -125,6 +127,29 @@ class GccConfig(object):
             config_string_list.extend(['-include ' + shlex.quote(s) for s in self._include_files])
         return ' '.join(config_string_list)
 
+    def gen_command_args_without_input_output(self):
+        """Return the options of `gen_command_string_without_input_output` as args, in the given order."""
+        config_args = list()
+        if self._sysroot:
+            config_args.append('--sysroot=' + self._sysroot)
+        if self._include_dirs:
+            config_args.extend(['-I' + s for s in self._include_dirs])
+        if self._sys_include_dirs:
+            for s in self._sys_include_dirs:
+                config_args.extend(('-isystem', s))
+        if self._library_dirs:
+            config_args.extend(['-L' + s for s in self._library_dirs])
+        if self._define_undef:
+            config_args.extend(self._define_undef)
+        if self._c_cpp_std:
+            config_args.append('-std=' + self._c_cpp_std)
+        if self._other_options:
+            config_args.extend(self._other_options)
+        if self._include_files:
+            for s in self._include_files:
+                config_args.extend(('-include', s))
+        return config_args
+
     def get_only_do_preprocessing(self):
         return self._only_do_preprocessing
 
@@ -139,8 +164,18 @@ class GccConfig(object):
     def get_command_name(self):
         return self._command
 
+    def get_cwd(self):
+        return self._cwd
+
+    def get_dep_file(self):
+        return self._dep_file
+
+    def get_dep_file_option(self):
+        return self._dep_file_option
+
     def copy(self):
-        return copy.deepcopy(self)
+        # a config is not changed after its command is replayed, copies can share it
+        return self
 
 
 def get_command_macros(command):
@@ -150,6 +185,18 @@ def get_command_macros(command):
         return ''
 
 
+def get_default_configs():
+    """Return the default config of all compilers queried so far, see `set_default_configs`."""
+    return dict(_init_default_include_dirs), dict(_init_default_sys_include_dirs), dict(_init_default_macros)
+
+
+def set_default_configs(configs):
+    include_dirs, sys_include_dirs, macros = configs
+    _init_default_include_dirs.update(include_dirs)
+    _init_default_sys_include_dirs.update(sys_include_dirs)
+    _init_default_macros.update(macros)
+
+
 def run(fs: VFs, target, cmd, cwd, env):
     config = GccConfig()
     config._cwd = cwd
@@ -208,6 +255,23 @@ def run(fs: VFs, target, cmd, cwd, env):
         if inc_dir in config._sys_include_dirs_set:
             config._sys_include_dirs.remove(inc_dir)
 
+    if config._dep_file_option and not config._dep_file:
+        # gcc names the dependency file after the output file, or the input file if no output file is given
+        if config._output_file:
+            dep_file = config._output_file[0]
+        elif config._input_files:
+            dep_file = join(cwd, get_base_name(config._input_files[0][0]))
+        else:
+            dep_file = None
+        if dep_file:
+            dot_pos = dep_file.rfind('.')
+            if dot_pos > dep_file.rfind('/'):
+                dep_file = dep_file[:dot_pos]
+            config._dep_file = dep_file + '.d'
+    elif not config._dep_file_option:
+        # -MF alone goes with -M or -MM, which write no objects
+        config._dep_file = None
+
     config._input_files = tuple(config._input_files)
     config._include_files = tuple(config._include_files)
     config._linked_libs = tuple(config._linked_libs)
@@ -637,7 +701,19 @@ def _parse_dependencies_generation(fs: VFs, config: GccConfig, argv, pos):
     if argv[pos][:2] != '-M':
         return _parse_other_options(fs, config, argv, pos)
     config._generate_dependencies = True
-    if argv[pos] in ('-MF', '-MT'):
+    option = argv[pos]
+    if option in ('-MD', '-MMD'):
+        config._dep_file_option = option
+    elif option[:3] == '-MF':
+        path = option[3:]
+        if not path:
+            pos += 1
+            if pos < len(argv):
+                path = argv[pos]
+        if not path:
+            raise ValueError("missing filename after '-MF'")
+        config._dep_file = join(config._cwd, path)
+    elif option in ('-MT', '-MQ'):
         pos += 1
     return pos + 1
 
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+
+##
+# Copyright (c) Nokia 2018. All rights reserved.
+#
+# Author: 
+# Email: nokia-sbell.com
+#
+
+
+class GeneratorContext(object):
+    """State of generating the CMakeLists.txt of a project, shared by all of its targets."""
+
+    def __init__(self, fs, root, dependency_tree, tmp_dir):
+        self.fs = fs
+        self.root = root
+        self.dependency_tree = dependency_tree
+        self.tmp_dir = tmp_dir
+        # flag set key -> flag set id, the configs with the same flags share an id
+        self.flag_set_ids = dict()
+        # flag set id -> (include dirs, definitions, options)
+        self.compile_flags = list()
+        # compile flags -> flag set id, the keys rendered to the same flags share an id
+        self._compile_flag_ids = dict()
+        # gcc config of an object -> (srcs, flag set id)
+        self.object_configs = dict()
+        # (srcs, flag set ids, libs) of a generated target -> target name
+        self.target_names = dict()
+        # (srcs, flag set id) -> name of the OBJECT library of the srcs
+        self.object_library_names = dict()
+        # kind -> include dirs, definitions or options -> name of the INTERFACE library of them
+        self.interface_names = dict()
+        # names of the generated targets
+        self.used_target_names = set()
+
+    def get_flag_set_id(self, key):
+        """Return the id of flag set `key`, None if it has none yet, see `add_flag_set`."""
+        return self.flag_set_ids.get(key)
+
+    def add_flag_set(self, key, compile_flags):
+        flag_set_id = self._compile_flag_ids.get(compile_flags)
+        if flag_set_id is None:
+            flag_set_id = len(self.compile_flags)
+            self.compile_flags.append(compile_flags)
+            self._compile_flag_ids[compile_flags] = flag_set_id
+        self.flag_set_ids[key] = flag_set_id
+        return flag_set_id
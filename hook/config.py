@@ -189,6 +189,12 @@ do_not_hook = [
 hook_install_dir = os.getcwd()
 # where to store the logs
 logfile = 'command_hook.jsonlogs'
+# log format, 'json' or 'binary' (smaller and faster to load, read by generator only)
+log_format = 'json'
+# write the log as a dir of per-cpu shards without locking, for highly parallel builds (read by generator only)
+log_sharded = False
+# write an environment to a json log only once and refer to it by id afterwards (binary logs always do)
+log_env_delta = True
 
 # DO NOT EDIT
 hook_bin_dir = os.path.join(hook_install_dir, 'hook_bin')
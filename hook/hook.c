@@ -11,6 +11,8 @@
 #include <fcntl.h>
 #include <libgen.h>
 #include <limits.h>
+#include <sched.h>
+#include <stdint.h>
 #include <stdio.h>
 #include <stdlib.h>
 #include <sys/file.h>
@@ -18,6 +20,7 @@
 #include <sys/stat.h>
 #include <sys/types.h>
 #include <sys/wait.h>
+#include <time.h>
 #include <unistd.h>
 
 #define TARGET_CONFIG_FILE_SUFFIX ".target"
@@ -68,6 +71,389 @@ void fprint_string_escape(FILE *file, const char *str) {
 	}
 }
 
+void fprint_json_string_array(FILE *file, int count, char **strings) {
+	fprintf(file, "[");
+	for (int i = 0; i < count; i++) {
+		if (i > 0) {
+			fprintf(file, ",");
+		}
+		fprintf(file, "\"");
+		fprint_string_escape(file, strings[i]);
+		fprintf(file, "\"");
+	}
+	fprintf(file, "]");
+}
+
+// `env` is NULL if the record refers to an env defined by an earlier line of the log
+void fprint_json_fields(FILE *file, const char *hookProg, const char *hookedProg, char **env, uint64_t envId,
+		const char *workingDir, int argc, char **argv) {
+	fprintf(file, "\"hookProg\":\"");
+	fprint_string_escape(file, hookProg);
+	fprintf(file, "\",\"hookedProg\":\"");
+	fprint_string_escape(file, hookedProg);
+	fprintf(file, "\"");
+
+	// print envs
+	if (env == NULL) {
+		fprintf(file, ",\"envId\":\"%016llx\"", (unsigned long long) envId);
+	} else {
+		int envCount = 0;
+		while (env[envCount] != NULL) envCount++;
+		fprintf(file, ",\"envs\":");
+		fprint_json_string_array(file, envCount, env);
+	}
+
+	// print working dir
+	fprintf(file, ",\"cwd\":\"");
+	fprint_string_escape(file, workingDir);
+	fprintf(file, "\"");
+
+	// print command
+	fprintf(file, ",\"cmd\":");
+	fprint_json_string_array(file, argc, argv);
+}
+
+#ifdef SHARDED_LOG
+/*
+ * The log is a dir of shards, one per cpu. Every record is appended to the
+ * shard of the current cpu by a single write() without locking. A record
+ * carries the time it was logged, commands are ordered by it when the
+ * shards are merged.
+ */
+#define SHARD_FILE_FORMAT "%s/shard-%03d"
+#define SHARD_INDEX_DIR_FORMAT "%s/idx"
+#endif
+
+uint64_t get_time_ns() {
+	struct timespec now;
+	clock_gettime(CLOCK_MONOTONIC, &now);
+	return (uint64_t) now.tv_sec * 1000000000ULL + now.tv_nsec;
+}
+
+/*
+ * Interning: a string or an environment is identified by the FNV-1a hash of
+ * its content and is written to the log only by the first command using it.
+ * A marker file per id in LOG.idx/SESSION (or LOG/idx for a sharded log)
+ * tells which ids are already in the log, the session changes whenever the
+ * log is started again. A marker is created only after the definition is
+ * written, so commands running at once may both define an id, the reader
+ * keeps either of the same definitions.
+ */
+#define LOG_INDEX_SUFFIX ".idx"
+#define FNV_OFFSET_BASIS 0xcbf29ce484222325ULL
+#define ENV_MARKER 'E'
+
+uint64_t hash_string(uint64_t hash, const char *str) {
+	// FNV-1a, the terminating '\0' is hashed to separate strings
+	const unsigned char *p = (const unsigned char *) str;
+	do {
+		hash ^= *p;
+		hash *= 0x100000001b3ULL;
+	} while (*p++ != '\0');
+	return hash;
+}
+
+uint64_t hash_env(char **env) {
+	uint64_t envId = FNV_OFFSET_BASIS;
+	for (int i = 0; env[i] != NULL; i++) {
+		envId = hash_string(envId, env[i]);
+	}
+	return envId;
+}
+
+// return 1 if `id` is not in the log yet and the caller has to define it, see `mark_interned`
+int intern_id(const char *indexDir, char type, uint64_t id) {
+	char markerFile[PATH_MAX];
+	snprintf(markerFile, sizeof(markerFile), "%s/%c%016llx", indexDir, type, (unsigned long long) id);
+	return access(markerFile, F_OK) != 0;
+}
+
+// record that `id` is in the log, only after its definition is written
+void mark_interned(const char *indexDir, char type, uint64_t id) {
+	char markerFile[PATH_MAX];
+	snprintf(markerFile, sizeof(markerFile), "%s/%c%016llx", indexDir, type, (unsigned long long) id);
+	int fd = open(markerFile, O_CREAT | O_WRONLY, 0666);
+	if (fd >= 0) {
+		close(fd);
+	}
+}
+
+uint64_t new_session_id() {
+	uint64_t session = 0;
+	int fd = open("/dev/urandom", O_RDONLY);
+	if (fd >= 0) {
+		if (read(fd, &session, sizeof(session)) != sizeof(session)) {
+			session = 0;
+		}
+		close(fd);
+	}
+	if (session == 0) {
+		session = ((uint64_t) time(NULL) << 32) ^ (uint64_t) getpid();
+	}
+	return session;
+}
+
+// return the marker dir of a session of a single log, to be freed by the caller
+char *make_session_index_dir(const char *logFilePath, uint64_t session) {
+	size_t indexDirSize = strlen(logFilePath) + sizeof(LOG_INDEX_SUFFIX) + 17;
+	char *indexDir = malloc(indexDirSize);
+	snprintf(indexDir, indexDirSize, "%s%s", logFilePath, LOG_INDEX_SUFFIX);
+	mkdir(indexDir, 0777);
+	snprintf(indexDir, indexDirSize, "%s%s/%016llx", logFilePath, LOG_INDEX_SUFFIX, (unsigned long long) session);
+	mkdir(indexDir, 0777);
+	return indexDir;
+}
+
+#ifdef ENV_DELTA_LOG
+/*
+ * JSON log with env delta: an environment is written once by a line
+ * {"envId":ID,"envs":[...]} before the first command using it, commands
+ * carry "envId":ID instead of "envs". A single log starts with the line
+ * {"session":SESSION}, envs are never delta encoded in a log without it.
+ */
+#define JSON_SESSION_FORMAT "{\"session\":\"%016llx\"}"
+
+// print the definition line of `env` if it is not in the log yet, return its id
+// `defined` is set if the line is printed, the env is to be marked by `mark_interned` once it is written
+uint64_t fprint_json_env_delta(FILE *file, const char *indexDir, char **env, int *defined) {
+	uint64_t envId = hash_env(env);
+	*defined = intern_id(indexDir, ENV_MARKER, envId);
+	if (*defined) {
+		int envCount = 0;
+		while (env[envCount] != NULL) envCount++;
+		fprintf(file, "{\"envId\":\"%016llx\",\"envs\":", (unsigned long long) envId);
+		fprint_json_string_array(file, envCount, env);
+		fprintf(file, "}\n");
+	}
+	return envId;
+}
+#endif
+
+#ifdef BINARY_LOG
+/*
+ * Binary log layout (all integers little-endian):
+ *
+ *   header : "HKLB" u32 version u64 session
+ *   record : u32 length u8 type payload[length - 1]
+ *
+ *   'S' string  : u64 id, bytes
+ *   'E' env     : u64 id, u32 count, count * (u32 length, bytes)
+ *   'C' command : u64 time, u32 pid, u64 hookProg id, u64 hookedProg id,
+ *                 u64 cwd id, u64 env id, u32 argc, argc * (u32 length, bytes)
+ *
+ * Strings and environments are interned, see above, and written only by
+ * the first command using them.
+ */
+#define BINARY_LOG_MAGIC "HKLB"
+#define BINARY_LOG_VERSION 1
+#define BINARY_LOG_HEADER_SIZE 16
+
+#define RECORD_STRING 'S'
+#define RECORD_ENV ENV_MARKER
+#define RECORD_COMMAND 'C'
+
+struct buffer {
+	unsigned char *data;
+	size_t size;
+	size_t capacity;
+};
+
+// ids defined by a command, marked once its records are written
+#define MAX_DEFINED_IDS 4
+
+struct defined_ids {
+	int count;
+	char types[MAX_DEFINED_IDS];
+	uint64_t ids[MAX_DEFINED_IDS];
+};
+
+void add_defined_id(struct defined_ids *defined, char type, uint64_t id) {
+	defined->types[defined->count] = type;
+	defined->ids[defined->count] = id;
+	defined->count++;
+}
+
+void buffer_put(struct buffer *buf, const void *data, size_t size) {
+	if (buf->size + size > buf->capacity) {
+		size_t capacity = buf->capacity ? buf->capacity : 4096;
+		while (buf->size + size > capacity) {
+			capacity *= 2;
+		}
+		buf->data = realloc(buf->data, capacity);
+		if (buf->data == NULL) {
+			printf("[HOOK] Error allocating log buffer\n");
+			exit(1);
+		}
+		buf->capacity = capacity;
+	}
+	memcpy(buf->data + buf->size, data, size);
+	buf->size += size;
+}
+
+void buffer_put_u32(struct buffer *buf, uint32_t value) {
+	unsigned char bytes[4];
+	for (int i = 0; i < 4; i++) {
+		bytes[i] = (value >> (i * 8)) & 0xff;
+	}
+	buffer_put(buf, bytes, sizeof(bytes));
+}
+
+void buffer_put_u64(struct buffer *buf, uint64_t value) {
+	unsigned char bytes[8];
+	for (int i = 0; i < 8; i++) {
+		bytes[i] = (value >> (i * 8)) & 0xff;
+	}
+	buffer_put(buf, bytes, sizeof(bytes));
+}
+
+void buffer_put_string(struct buffer *buf, const char *str) {
+	uint32_t length = strlen(str);
+	buffer_put_u32(buf, length);
+	buffer_put(buf, str, length);
+}
+
+size_t buffer_begin_record(struct buffer *buf, char type) {
+	size_t offset = buf->size;
+	buffer_put_u32(buf, 0);
+	buffer_put(buf, &type, 1);
+	return offset;
+}
+
+void buffer_end_record(struct buffer *buf, size_t offset) {
+	uint32_t length = buf->size - offset - 4;
+	for (int i = 0; i < 4; i++) {
+		buf->data[offset + i] = (length >> (i * 8)) & 0xff;
+	}
+}
+
+void buffer_put_interned_string(struct buffer *buf, const char *indexDir, struct defined_ids *defined, uint64_t id,
+		const char *str) {
+	if (intern_id(indexDir, RECORD_STRING, id)) {
+		size_t record = buffer_begin_record(buf, RECORD_STRING);
+		buffer_put_u64(buf, id);
+		buffer_put(buf, str, strlen(str));
+		buffer_end_record(buf, record);
+		add_defined_id(defined, RECORD_STRING, id);
+	}
+}
+
+// open a binary log to append to, a new log is created with its header by link(), so that no record can precede it
+int open_binary_log(const char *logFilePath, int newSession) {
+	int logFd = open(logFilePath, O_RDWR | O_APPEND);
+	if (logFd >= 0 || errno != ENOENT) {
+		return logFd;
+	}
+	// the header is written to a hidden file in the dir of the log, not matched as a shard
+	const char *baseName = strrchr(logFilePath, '/');
+	int dirLength = baseName == NULL ? 0 : baseName - logFilePath + 1;
+	baseName = baseName == NULL ? logFilePath : baseName + 1;
+	size_t tmpPathSize = strlen(logFilePath) + 32;
+	char *tmpPath = malloc(tmpPathSize);
+	snprintf(tmpPath, tmpPathSize, "%.*s.%s.%d.tmp", dirLength, logFilePath, baseName, (int) getpid());
+	int tmpFd = open(tmpPath, O_WRONLY | O_CREAT | O_EXCL, 0666);
+	if (tmpFd >= 0) {
+		struct buffer header = {NULL, 0, 0};
+		buffer_put(&header, BINARY_LOG_MAGIC, 4);
+		buffer_put_u32(&header, BINARY_LOG_VERSION);
+		buffer_put_u64(&header, newSession ? new_session_id() : 0);
+		// fails with EEXIST if another command created the log first, its header is used then
+		if (write(tmpFd, header.data, header.size) == header.size && link(tmpPath, logFilePath) < 0
+				&& errno != EEXIST) {
+			// no hard links on the fs, the header is written right after the log is created
+			logFd = open(logFilePath, O_WRONLY | O_CREAT | O_EXCL, 0666);
+			if (logFd >= 0) {
+				if (write(logFd, header.data, header.size) != header.size) {
+					printf("[HOOK] Error writing %s file\n", logFilePath);
+				}
+				close(logFd);
+			}
+		}
+		close(tmpFd);
+		unlink(tmpPath);
+		free(header.data);
+	}
+	free(tmpPath);
+	return open(logFilePath, O_RDWR | O_APPEND);
+}
+
+// `indexDir` is NULL for a single log, the markers are then kept per session of the log
+void write_binary_log(const char *logFilePath, const char *indexDir, const char *hookProg, const char *hookedProg,
+		char **env, const char *workingDir, int argc, char **argv) {
+	struct buffer buf = {NULL, 0, 0};
+	int i;
+	int logFd = open_binary_log(logFilePath, indexDir == NULL);
+	if (logFd < 0) {
+		printf("[HOOK] Error open %s file\n", logFilePath);
+		exit(1);
+	}
+	// session of the log, from its header
+	uint64_t session = 0;
+	unsigned char header[BINARY_LOG_HEADER_SIZE];
+	if (pread(logFd, header, sizeof(header), 0) != sizeof(header) || memcmp(header, BINARY_LOG_MAGIC, 4) != 0) {
+		printf("[HOOK] Error %s is not a binary hook log\n", logFilePath);
+		exit(1);
+	}
+	for (i = 0; i < 8; i++) {
+		session |= (uint64_t) header[8 + i] << (i * 8);
+	}
+	// dir of the interned id markers
+	char *sessionIndexDir = NULL;
+	if (indexDir == NULL) {
+		sessionIndexDir = make_session_index_dir(logFilePath, session);
+		indexDir = sessionIndexDir;
+	}
+
+	// interned strings and env
+	struct defined_ids defined = {0};
+	uint64_t hookProgId = hash_string(FNV_OFFSET_BASIS, hookProg);
+	uint64_t hookedProgId = hash_string(FNV_OFFSET_BASIS, hookedProg);
+	uint64_t workingDirId = hash_string(FNV_OFFSET_BASIS, workingDir);
+	buffer_put_interned_string(&buf, indexDir, &defined, hookProgId, hookProg);
+	buffer_put_interned_string(&buf, indexDir, &defined, hookedProgId, hookedProg);
+	buffer_put_interned_string(&buf, indexDir, &defined, workingDirId, workingDir);
+	uint32_t envCount = 0;
+	while (env[envCount] != NULL) envCount++;
+	uint64_t envId = hash_env(env);
+	if (intern_id(indexDir, RECORD_ENV, envId)) {
+		size_t record = buffer_begin_record(&buf, RECORD_ENV);
+		buffer_put_u64(&buf, envId);
+		buffer_put_u32(&buf, envCount);
+		for (i = 0; i < envCount; i++) {
+			buffer_put_string(&buf, env[i]);
+		}
+		buffer_end_record(&buf, record);
+		add_defined_id(&defined, RECORD_ENV, envId);
+	}
+
+	// command
+	size_t record = buffer_begin_record(&buf, RECORD_COMMAND);
+	buffer_put_u64(&buf, get_time_ns());
+	buffer_put_u32(&buf, getpid());
+	buffer_put_u64(&buf, hookProgId);
+	buffer_put_u64(&buf, hookedProgId);
+	buffer_put_u64(&buf, workingDirId);
+	buffer_put_u64(&buf, envId);
+	buffer_put_u32(&buf, argc);
+	for (i = 0; i < argc; i++) {
+		buffer_put_string(&buf, argv[i]);
+	}
+	buffer_end_record(&buf, record);
+
+	if (write(logFd, buf.data, buf.size) != buf.size) {
+		printf("[HOOK] Error writing %s file\n", logFilePath);
+		printf("[HOOK] errno: %d\n", errno);
+		exit(1);
+	}
+	close(logFd);
+	// the definitions are in the log
+	for (i = 0; i < defined.count; i++) {
+		mark_interned(indexDir, defined.types[i], defined.ids[i]);
+	}
+	free(sessionIndexDir);
+	free(buf.data);
+}
+#endif
+
 int main(int argc, char **argv, char **envp) {
 	int i;
 	int ret;
@@ -164,46 +550,12 @@ int main(int argc, char **argv, char **envp) {
 		targetPathLength--;
 	}
 
-	// lock and open log file
-	int logLockFd = open(LOCK_FILE, O_CREAT | O_RDWR, 0666);
-	if (logLockFd < 0) {
-		printf("[HOOK] Error open %s file\n", LOCK_FILE);
-		printf("[HOOK] errno: %d\n", errno);
-		exit(1);
-	}
-	if (flock(logLockFd, LOCK_EX) < 0) {
-		printf("[HOOK] Error locking %s file\n", LOCK_FILE);
-		printf("[HOOK] errno: %d\n", errno);
-		exit(1);
-	}
-	FILE *ptrLogFile = fopen(logFilePath, "a");
-	if (ptrLogFile == NULL) {
-		printf("[HOOK] Error open %s file\n", logFilePath);
-		exit(1);
-	}
-	if (ftell(ptrLogFile) > 0) {
-		fprintf(ptrLogFile, "\n");
-	}
-
-
-
-	fprintf(ptrLogFile, "{\"hookProg\":\"");
-	fprint_string_escape(ptrLogFile, exePath);
-	fprintf(ptrLogFile, "\",\"hookedProg\":\"");
-	fprint_string_escape(ptrLogFile, targetPath);
-	fprintf(ptrLogFile, "\"");
-#ifdef PRINT_TO_TERMINAL
-	printf("[HOOK] Hook Path   : %s\n", exePath);
-	printf("[HOOK] Hooked Prog : %s\n", targetPath);
-#endif
-
 	// count envs
 	int envCount = 0;
 	while (envp[envCount] != NULL) envCount++;
 	char **env = malloc((envCount + 1) * sizeof(char *));
 
 	// make a copy of envs
-	fprintf(ptrLogFile, ",\"envs\":[");
 	char *envModify = malloc(targetPathLength + 3);
 	envModify[0] = '_';
 	envModify[1] = '=';
@@ -215,18 +567,8 @@ int main(int argc, char **argv, char **envp) {
 			// allocate new string memory
 			env[i] = envModify;
 		}
-		if (i > 0) {
-			fprintf(ptrLogFile, ",");
-		}
-		fprintf(ptrLogFile, "\"");
-		fprint_string_escape(ptrLogFile, env[i]);
-		fprintf(ptrLogFile, "\"");
-#ifdef PRINT_TO_TERMINAL
-		printf("[HOOK] env[%4d] = : %s\n", i, env[i]);
-#endif
 	}
 	env[envCount] = NULL;
-	fprintf(ptrLogFile, "]");
 
 	// get working dir
 	char *workingDir = malloc(PATH_MAX);
@@ -234,36 +576,27 @@ int main(int argc, char **argv, char **envp) {
 		printf("[HOOK] Error getcwd() return value\n");
 		exit(1);
 	}
-	fprintf(ptrLogFile, ",\"cwd\":\"");
-	fprint_string_escape(ptrLogFile, workingDir);
-	fprintf(ptrLogFile, "\"");
-#ifdef PRINT_TO_TERMINAL
-	printf("[HOOK] Working Dir : %s\n", workingDir);
-#endif
 
-	// print command
+	// make a copy of command
 	char **parm = malloc((argc + 1) * sizeof(char *));
-	fprintf(ptrLogFile, ",\"cmd\":[");
-#ifdef PRINT_TO_TERMINAL
-	printf("[HOOK] Command     :");
-#endif
 	for (i = 0; i < argc; i++) {
 		parm[i] = argv[i];
-		if (i > 0) {
-			fprintf(ptrLogFile, ",");
-		}
-		fprintf(ptrLogFile, "\"");
-		fprint_string_escape(ptrLogFile, argv[i]);
-		fprintf(ptrLogFile, "\"");
-#ifdef PRINT_TO_TERMINAL
-		printf(" %s", argv[i]);
-#endif
 	}
 	parm[argc] = NULL;
 	// change command line base name
 	parm[0] = targetPath;
-	fprintf(ptrLogFile, "]}");
+
 #ifdef PRINT_TO_TERMINAL
+	printf("[HOOK] Hook Path   : %s\n", exePath);
+	printf("[HOOK] Hooked Prog : %s\n", targetPath);
+	for (i = 0; i < envCount; i++) {
+		printf("[HOOK] env[%4d] = : %s\n", i, env[i]);
+	}
+	printf("[HOOK] Working Dir : %s\n", workingDir);
+	printf("[HOOK] Command     :");
+	for (i = 0; i < argc; i++) {
+		printf(" %s", argv[i]);
+	}
 	printf("\n");
 
 	printf("[HOOK] ");
@@ -274,14 +607,143 @@ int main(int argc, char **argv, char **envp) {
 	printf("\n");
 #endif
 
+#ifdef SHARDED_LOG
+	// get shard of current cpu
+	mkdir(logFilePath, 0777);
+	int cpu = sched_getcpu();
+	if (cpu < 0) {
+		cpu = 0;
+	}
+	char *shardFilePath = malloc(logFilePathLength + 16);
+	snprintf(shardFilePath, logFilePathLength + 16, SHARD_FILE_FORMAT, logFilePath, cpu);
+#if defined(BINARY_LOG) || defined(ENV_DELTA_LOG)
+	char *indexDir = malloc(logFilePathLength + 8);
+	snprintf(indexDir, logFilePathLength + 8, SHARD_INDEX_DIR_FORMAT, logFilePath);
+	mkdir(indexDir, 0777);
+#endif
+#ifdef BINARY_LOG
+	write_binary_log(shardFilePath, indexDir, exePath, targetPath, env, workingDir, argc, argv);
+#else
+	char *record = NULL;
+	size_t recordSize = 0;
+	FILE *ptrRecord = open_memstream(&record, &recordSize);
+	if (ptrRecord == NULL) {
+		printf("[HOOK] Error allocating log buffer\n");
+		exit(1);
+	}
+#ifdef ENV_DELTA_LOG
+	int envDefined;
+	uint64_t envId = fprint_json_env_delta(ptrRecord, indexDir, env, &envDefined);
+#endif
+	fprintf(ptrRecord, "{\"time\":%llu,\"pid\":%d,", (unsigned long long) get_time_ns(), (int) getpid());
+#ifdef ENV_DELTA_LOG
+	fprint_json_fields(ptrRecord, exePath, targetPath, NULL, envId, workingDir, argc, argv);
+#else
+	fprint_json_fields(ptrRecord, exePath, targetPath, env, 0, workingDir, argc, argv);
+#endif
+	fprintf(ptrRecord, "}\n");
+	fclose(ptrRecord);
+	int shardFd = open(shardFilePath, O_WRONLY | O_APPEND | O_CREAT, 0666);
+	if (shardFd < 0) {
+		printf("[HOOK] Error open %s file\n", shardFilePath);
+		exit(1);
+	}
+	if (write(shardFd, record, recordSize) != recordSize) {
+		printf("[HOOK] Error writing %s file\n", shardFilePath);
+		printf("[HOOK] errno: %d\n", errno);
+		exit(1);
+	}
+	close(shardFd);
+	free(record);
+#ifdef ENV_DELTA_LOG
+	if (envDefined) {
+		mark_interned(indexDir, ENV_MARKER, envId);
+	}
+#endif
+#endif
+#if defined(BINARY_LOG) || defined(ENV_DELTA_LOG)
+	free(indexDir);
+#endif
+	free(shardFilePath);
+#else
+	// lock log file
+	int logLockFd = open(LOCK_FILE, O_CREAT | O_RDWR, 0666);
+	if (logLockFd < 0) {
+		printf("[HOOK] Error open %s file\n", LOCK_FILE);
+		printf("[HOOK] errno: %d\n", errno);
+		exit(1);
+	}
+	if (flock(logLockFd, LOCK_EX) < 0) {
+		printf("[HOOK] Error locking %s file\n", LOCK_FILE);
+		printf("[HOOK] errno: %d\n", errno);
+		exit(1);
+	}
+
+#ifdef BINARY_LOG
+	write_binary_log(logFilePath, NULL, exePath, targetPath, env, workingDir, argc, argv);
+#else
+	FILE *ptrLogFile = fopen(logFilePath, "a+");
+	if (ptrLogFile == NULL) {
+		printf("[HOOK] Error open %s file\n", logFilePath);
+		exit(1);
+	}
+	fseek(ptrLogFile, 0, SEEK_END);
+	long logFileSize = ftell(ptrLogFile);
+#ifdef ENV_DELTA_LOG
+	// a new log starts a session, an old log without it is continued with full envs
+	unsigned long long session = 0;
+	int envDelta = 1;
+	int envDefined = 0;
+	uint64_t envId = 0;
+	char *indexDir = NULL;
+	if (logFileSize == 0) {
+		session = new_session_id();
+		fprintf(ptrLogFile, JSON_SESSION_FORMAT, session);
+		logFileSize = 1;
+	} else {
+		rewind(ptrLogFile);
+		envDelta = fscanf(ptrLogFile, JSON_SESSION_FORMAT, &session) == 1;
+		fseek(ptrLogFile, 0, SEEK_END);
+	}
+#endif
+	if (logFileSize > 0) {
+		fprintf(ptrLogFile, "\n");
+	}
+#ifdef ENV_DELTA_LOG
+	if (envDelta) {
+		indexDir = make_session_index_dir(logFilePath, session);
+		envId = fprint_json_env_delta(ptrLogFile, indexDir, env, &envDefined);
+		fprintf(ptrLogFile, "{");
+		fprint_json_fields(ptrLogFile, exePath, targetPath, NULL, envId, workingDir, argc, argv);
+	} else {
+		fprintf(ptrLogFile, "{");
+		fprint_json_fields(ptrLogFile, exePath, targetPath, env, 0, workingDir, argc, argv);
+	}
+#else
+	fprintf(ptrLogFile, "{");
+	fprint_json_fields(ptrLogFile, exePath, targetPath, env, 0, workingDir, argc, argv);
+#endif
+	fprintf(ptrLogFile, "}");
+#ifdef ENV_DELTA_LOG
+	// the env is marked once its line is in the log
+	if (envDefined && fflush(ptrLogFile) == 0) {
+		mark_interned(indexDir, ENV_MARKER, envId);
+	}
+	free(indexDir);
+#endif
+#endif
+
 #ifdef TEST_LOCK
 	sleep(5);
 #endif
 
 	// close log file and unlock
+#ifndef BINARY_LOG
 	fclose(ptrLogFile);
+#endif
 	flock(logLockFd, LOCK_UN);
 	close(logLockFd);
+#endif
 
 	free(exePath);
 	free(tmpExePath);
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+
+##
+# Copyright (c) Nokia 2018. All rights reserved.
+#
+# Author: 
+# Email: nokia-sbell.com
+#
+
+import os
+import re
+import glob
+import json
+import mmap
+import time
+import struct
+import collections
+import multiprocessing
+
+from path_helper import join, get_base_name
+
+# bytes of log handed to a worker at once
+CHUNK_SIZE = 4 * 1024 * 1024
+# records of a sharded log handed to a worker at once
+RECORD_BATCH_SIZE = 4096
+# seconds between two throughput reports
+REPORT_INTERVAL = 5.0
+
+# binary log written by hook.c compiled with BINARY_LOG, see the layout described there
+BINARY_LOG_MAGIC = b'HKLB'
+BINARY_LOG_VERSION = 1
+_RECORD_STRING = ord('S')
+_RECORD_ENV = ord('E')
+_RECORD_COMMAND = ord('C')
+_binary_header = struct.Struct('<4sIQ')
+_record_header = struct.Struct('<IB')
+_command_header = struct.Struct('<QIQQQQI')
+_env_header = struct.Struct('<QI')
+_u32 = struct.Struct('<I')
+_u64 = struct.Struct('<Q')
+
+# sharded log written by hook.c compiled with SHARDED_LOG
+SHARD_FILE_PATTERN = 'shard-*'
+_json_shard_key = re.compile(rb'{"time":(\d+),"pid":(\d+),')
+
+# json log written by hook.c compiled with ENV_DELTA_LOG, an env is defined once by a line
+# {"envId":ID,"envs":[...]} and commands refer to it by "envId", a single log starts with a session line
+_JSON_ENV_PREFIX = b'{"envId":'
+_JSON_SESSION_PREFIX = b'{"session":'
+
+
+def load_hook_log(path, env_commands=(), processes=None):
+    """Yield the records of a command hook log in log order.
+
+    A JSON log is read in large chunks which are decoded by worker processes,
+    a binary log is memory-mapped and decoded in place. A sharded log (a dir
+    of shards) is merged by the time the records were logged. The `envs` of
+    a record is dropped unless its hook program is listed in `env_commands`,
+    delta encoded envs are resolved only for those records.
+    """
+    if processes is None:
+        processes = multiprocessing.cpu_count() - 1
+    env_commands = frozenset(env_commands)
+    if os.path.isdir(path):
+        yield from _load_sharded_log(path, env_commands, processes)
+    elif is_binary_log(path):
+        yield from _load_binary_log(path, env_commands)
+    else:
+        stat = _LoadStat()
+        envs = dict()
+        jobs = ((chunk, env_commands) for chunk in _read_chunks(path))
+        for job, records in _ordered_map(_worker_decode_chunk, jobs, processes):
+            count = 0
+            for log in records:
+                if 'cmd' in log:
+                    count += 1
+                    yield _resolve_json_env(log, envs)
+                else:
+                    envs[log['envId']] = log['envs']
+            stat.update(count, len(job[0]))
+        stat.report(True)
+
+
+def is_binary_log(path):
+    with open(path, 'rb') as log_file:
+        return log_file.read(len(BINARY_LOG_MAGIC)) == BINARY_LOG_MAGIC
+
+
+def _ordered_map(func, jobs, processes):
+    """Yield (job, func(job)) in job order, with a bounded number of jobs in flight."""
+    if processes < 1:
+        for job in jobs:
+            yield job, func(job)
+        return
+    with multiprocessing.Pool(processes=processes) as pool:
+        pending = collections.deque()
+        for job in jobs:
+            pending.append((job, pool.apply_async(func, (job,))))
+            if len(pending) >= processes * 2:
+                job, result = pending.popleft()
+                yield job, result.get()
+        while pending:
+            job, result = pending.popleft()
+            yield job, result.get()
+
+
+def _load_binary_log(path, env_commands):
+    stat = _LoadStat()
+    strings = dict()
+    envs = dict()
+    count = 0
+    last_pos = 0
+    with open(path, 'rb') as log_file:
+        with mmap.mmap(log_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for record_type, body, next_pos in _iter_binary_records(data, path):
+                if record_type == _RECORD_COMMAND:
+                    count += 1
+                    if count == 1000:
+                        stat.update(count, next_pos - last_pos)
+                        count = 0
+                        last_pos = next_pos
+                    yield _decode_binary_command(data, body, strings, envs, env_commands)
+                else:
+                    _decode_binary_definition(data, record_type, body, next_pos, strings, envs)
+            stat.update(count, len(data) - last_pos)
+    stat.report(True)
+
+
+def _iter_binary_records(data, path):
+    """Yield (type, body offset, next record offset) of all records in a binary log."""
+    magic, version, session = _binary_header.unpack_from(data, 0)
+    if version != BINARY_LOG_VERSION:
+        raise ValueError('unsupported binary hook log version {:d}'.format(version))
+    pos = _binary_header.size
+    end = len(data)
+    while pos + _record_header.size <= end:
+        length, record_type = _record_header.unpack_from(data, pos)
+        next_pos = pos + _u32.size + length
+        if next_pos > end:
+            print('WARNING: truncated record at the end of {:s}'.format(path), flush=True)
+            break
+        if record_type not in (_RECORD_STRING, _RECORD_ENV, _RECORD_COMMAND):
+            raise ValueError('unknown record type {:d} in {:s}'.format(record_type, path))
+        yield record_type, pos + _record_header.size, next_pos
+        pos = next_pos
+
+
+def _decode_binary_definition(data, record_type, body, next_pos, strings, envs):
+    if record_type == _RECORD_STRING:
+        strings[_u64.unpack_from(data, body)[0]] = _decode(data[(body + _u64.size):next_pos])
+    else:
+        env_id, env_count = _env_header.unpack_from(data, body)
+        envs[env_id] = _unpack_strings(data, body + _env_header.size, env_count)
+
+
+def _decode_binary_command(data, body, strings, envs, env_commands):
+    time_ns, pid, hook_prog, hooked_prog, cwd, env_id, argc = _command_header.unpack_from(data, body)
+    log = {'hookProg': strings[hook_prog], 'hookedProg': strings[hooked_prog], 'cwd': strings[cwd],
+           'cmd': _unpack_strings(data, body + _command_header.size, argc)}
+    if get_base_name(log['hookProg']) in env_commands:
+        log['envs'] = list(envs[env_id])
+    return log
+
+
+def _unpack_strings(data, pos, count):
+    result = list()
+    for _ in range(count):
+        length = _u32.unpack_from(data, pos)[0]
+        pos += _u32.size
+        result.append(_decode(data[pos:(pos + length)]))
+        pos += length
+    return result
+
+
+def _decode(data):
+    return data.decode('utf-8', 'surrogateescape')
+
+
+def _read_chunks(path):
+    with open(path, 'rb') as log_file:
+        rest = b''
+        while True:
+            data = log_file.read(CHUNK_SIZE)
+            if not data:
+                break
+            end = data.rfind(b'\n')
+            if end < 0:
+                rest += data
+                continue
+            yield rest + data[:end]
+            rest = data[(end + 1):]
+        if rest.strip():
+            yield rest
+
+
+def _worker_decode_chunk(job):
+    chunk, env_commands = job
+    records = list()
+    for line in chunk.split(b'\n'):
+        if not line.strip() or line.startswith(_JSON_SESSION_PREFIX):
+            continue
+        if line.startswith(_JSON_ENV_PREFIX):
+            # env definitions are only of use if some command reads its env
+            if env_commands:
+                records.append(json.loads(line))
+            continue
+        records.append(_decode_json_record(line, env_commands))
+    return records
+
+
+def _decode_json_record(line, env_commands):
+    log = json.loads(line)
+    if get_base_name(log['hookProg']) not in env_commands:
+        log.pop('envs', None)
+        log.pop('envId', None)
+    return log
+
+
+def _resolve_json_env(log, envs):
+    env_id = log.pop('envId', None)
+    if env_id is not None:
+        if env_id not in envs:
+            raise ValueError('undefined env id {:s} in hook log'.format(env_id))
+        log['envs'] = list(envs[env_id])
+    return log
+
+
+def _load_sharded_log(path, env_commands, processes):
+    stat = _LoadStat()
+    shard_files = sorted(glob.glob(join(path, SHARD_FILE_PATTERN)))
+    # index all shards, then order the commands by (time, pid)
+    commands = list()
+    strings = dict()
+    envs = dict()
+    binary = None
+    jobs = ((shard_file, env_commands) for shard_file in shard_files)
+    for shard_no, (job, index) in enumerate(_ordered_map(_worker_index_shard, jobs, processes)):
+        shard_binary, shard_commands, shard_strings, shard_envs = index
+        if shard_binary is None:
+            continue
+        if binary is None:
+            binary = shard_binary
+        elif binary != shard_binary:
+            raise ValueError('mixed binary and json shards in {:s}'.format(path))
+        commands.extend((key[0], key[1], shard_no, key[2], key[3]) for key in shard_commands)
+        strings.update(shard_strings)
+        envs.update(shard_envs)
+    commands.sort()
+    print('Merging {:d} records from {:d} shards...'.format(len(commands), len(shard_files)), flush=True)
+    if binary:
+        shard_data = list()
+        try:
+            for shard_file in shard_files:
+                with open(shard_file, 'rb') as f:
+                    shard_data.append(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            count = 0
+            size = 0
+            for command in commands:
+                count += 1
+                size += command[4]
+                if count == 1000:
+                    stat.update(count, size)
+                    count = 0
+                    size = 0
+                yield _decode_binary_command(shard_data[command[2]], command[3], strings, envs, env_commands)
+            stat.update(count, size)
+        finally:
+            for data in shard_data:
+                data.close()
+    else:
+        jobs = ((shard_files, [command[2:] for command in commands[i:(i + RECORD_BATCH_SIZE)]], env_commands)
+                for i in range(0, len(commands), RECORD_BATCH_SIZE))
+        for job, records in _ordered_map(_worker_decode_shard_records, jobs, processes):
+            stat.update(len(records), sum(item[2] for item in job[1]))
+            for log in records:
+                yield _resolve_json_env(log, envs)
+    stat.report(True)
+
+
+def _worker_index_shard(job):
+    """Return (is binary, [(time, pid, offset, length)], strings, envs) of a shard.
+
+    The offset of a binary command is its body, of a JSON command its line."""
+    shard_file, env_commands = job
+    commands = list()
+    strings = dict()
+    envs = dict()
+    with open(shard_file, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None, commands, strings, envs
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:len(BINARY_LOG_MAGIC)] == BINARY_LOG_MAGIC:
+                for record_type, body, next_pos in _iter_binary_records(data, shard_file):
+                    if record_type == _RECORD_COMMAND:
+                        time_ns, pid = _command_header.unpack_from(data, body)[:2]
+                        commands.append((time_ns, pid, body, next_pos - body))
+                    else:
+                        _decode_binary_definition(data, record_type, body, next_pos, strings, envs)
+                return True, commands, strings, envs
+            pos = 0
+            end = len(data)
+            while pos < end:
+                next_pos = data.find(b'\n', pos)
+                if next_pos < 0:
+                    next_pos = end
+                match = _json_shard_key.match(data, pos, next_pos)
+                if match:
+                    commands.append((int(match.group(1)), int(match.group(2)), pos, next_pos - pos))
+                elif data[pos:(pos + len(_JSON_ENV_PREFIX))] == _JSON_ENV_PREFIX:
+                    if env_commands:
+                        definition = json.loads(data[pos:next_pos])
+                        envs[definition['envId']] = definition['envs']
+                elif data[pos:next_pos].strip():
+                    print('WARNING: invalid record in {:s} at {:d}'.format(shard_file, pos), flush=True)
+                pos = next_pos + 1
+    return False, commands, strings, envs
+
+
+def _worker_decode_shard_records(job):
+    shard_files, commands, env_commands = job
+    records = list()
+    files = dict()
+    try:
+        for shard_no, offset, length in commands:
+            if shard_no not in files:
+                files[shard_no] = open(shard_files[shard_no], 'rb')
+            f = files[shard_no]
+            f.seek(offset)
+            records.append(_decode_json_record(f.read(length), env_commands))
+    finally:
+        for f in files.values():
+            f.close()
+    return records
+
+
+class _LoadStat(object):
+    def __init__(self):
+        self._start_time = time.monotonic()
+        self._last_report = self._start_time
+        self._records = 0
+        self._bytes = 0
+
+    def update(self, records, size):
+        self._records += records
+        self._bytes += size
+        if time.monotonic() - self._last_report >= REPORT_INTERVAL:
+            self.report()
+
+    def report(self, finished=False):
+        now = time.monotonic()
+        self._last_report = now
+        elapsed = max(now - self._start_time, 1e-6)
+        print('{:s} {:d} records, {:.1f} MB in {:.1f}s ({:.0f} records/s, {:.1f} MB/s)'.format(
+            'Loaded' if finished else 'Loading...', self._records, self._bytes / 1048576, elapsed,
+            self._records / elapsed, self._bytes / 1048576 / elapsed), flush=True)
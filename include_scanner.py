@@ -0,0 +1,463 @@
+#!/usr/bin/env python3
+
+##
+# Copyright (c) Nokia 2018. All rights reserved.
+#
+# Author: 
+# Email: nokia-sbell.com
+#
+
+import os
+import re
+import subprocess
+
+from path_helper import join, get_dir_name
+
+# comments, and the string and char literals which may contain comment marks
+_comment_pattern = re.compile(r'//[^\n]*|/\*.*?\*/|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'', re.S)
+_directive_pattern = re.compile(r'[ \t]*#[ \t]*(\w+)(.*)')
+_include_pattern = re.compile(r'\s*(?:<([^>]*)>|"([^"]*)")')
+_token_pattern = re.compile(r'\s*(?:(0[xX][0-9a-fA-F]+|\d+)[uUlL]*|(\'(?:\\.|[^\'\\])+\')|([A-Za-z_]\w*)|'
+                            r'(\|\||&&|==|!=|<=|>=|<<|>>|[-+*/%<>!~&|^?:(),]))')
+_search_list_pattern = re.compile(r'^#include "\.\.\." search starts here:\n(.*?)^#include <\.\.\.> search starts '
+                                  r'here:\n(.*?)^End of search list.$', re.M | re.S)
+# max depth of macros expanded in a condition
+_MAX_EXPANSION_DEPTH = 16
+
+
+class IncludeScanner(object):
+    """Find the files a src includes without preprocessing it, like makedepend.
+
+    The include dirs and the predefined macros of each compiler and set of options are asked from
+    the compiler once. Conditions are evaluated with the predefined macros only, a macro defined or
+    undefined in a file is unknown in the rest of it and any other macro may be defined by a header,
+    so a branch is skipped only if it can never be taken. The includes of each file are found once
+    for each set of include dirs and macros. The files found are a superset of the ones `gcc -M`
+    finds, unless a header redefines a predefined macro.
+    """
+
+    def __init__(self):
+        # path -> directives of the file, see `_read_directives`
+        self._directives = dict()
+        # (path, context id, if it is the src) -> paths included by the file, None if an include cannot be resolved
+        self._includes = dict()
+        # path -> if it is a file
+        self._is_file = dict()
+        # (command, options, language) -> context, see `get_context`
+        self._contexts = dict()
+
+    def get_context(self, command, args, language):
+        """Return the (id, quote dirs, bracket dirs, macros, files included first) of a compiler and its options.
+
+        None is returned if the compiler cannot be asked.
+        """
+        context_key = (command, tuple(args), language)
+        if context_key not in self._contexts:
+            self._contexts[context_key] = self._query_context(len(self._contexts), command, args, language)
+        return self._contexts[context_key]
+
+    def scan(self, file, context):
+        """Return `file` and the files it may include, None if an include cannot be resolved."""
+        files = [file]
+        found = {file}
+        for path in context[4]:
+            if path not in found:
+                files.append(path)
+                found.add(path)
+        i = 0
+        while i < len(files):
+            includes = self._get_includes(files[i], context, i == 0)
+            if includes is None:
+                return None
+            for path in includes:
+                if path not in found:
+                    files.append(path)
+                    found.add(path)
+            i += 1
+        return files
+
+    def _query_context(self, context_id, command, args, language):
+        quote_dirs = list()
+        bracket_dirs = list()
+        macros = dict()
+        include_files = list()
+        try:
+            result = subprocess.run([command, *args, '-x', language, '-dM', '-E', '-v', '-'],
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.DEVNULL)
+        except OSError:
+            result = None
+        if result is not None and result.returncode == 0:
+            match = _search_list_pattern.search(result.stderr.decode('utf-8', 'surrogateescape'))
+            if match:
+                quote_dirs = _get_search_dirs(match.group(1))
+                bracket_dirs = _get_search_dirs(match.group(2))
+            for line in result.stdout.decode('utf-8', 'surrogateescape').splitlines():
+                items = line.split(None, 2)
+                if len(items) < 2 or items[0] != '#define':
+                    continue
+                name = items[1]
+                value = items[2] if len(items) > 2 else ''
+                # function-like macros are defined but have no value usable in a condition
+                pos = name.find('(')
+                if pos >= 0:
+                    macros[name[:pos]] = None
+                else:
+                    macros[name] = value
+        else:
+            print('\nWARNING: cannot get the include dirs and macros of {:s}'.format(command), flush=True)
+            return None
+        # gcc includes stdc-predef.h of the c library first
+        if '-nostdinc' not in args and '-ffreestanding' not in args:
+            path = self._find('stdc-predef.h', bracket_dirs)
+            if path:
+                include_files.append(path)
+        for i in range(len(args) - 1):
+            if args[i] == '-include':
+                # searched in the working dir first, then in the quote dirs
+                path = os.path.abspath(args[i + 1])
+                if not self._isfile(path):
+                    path = self._find(args[i + 1], quote_dirs + bracket_dirs)
+                if path:
+                    include_files.append(path)
+        return context_id, tuple(quote_dirs), tuple(bracket_dirs), macros, tuple(include_files)
+
+    def _get_includes(self, path, context, is_src):
+        key = (path, context[0], is_src)
+        if key not in self._includes:
+            self._includes[key] = self._find_includes(path, context, is_src)
+        return self._includes[key]
+
+    def _find_includes(self, path, context, is_src):
+        directives = self._directives.get(path)
+        if directives is None:
+            directives = _read_directives(path)
+            self._directives[path] = directives
+        macros = context[3]
+        # macros defined or undefined in this file
+        changed_macros = set()
+        # (if the conditional is live, if its current branch is taken, if any of its branches is taken) of each
+        # conditional, unknown is None
+        branches = list()
+        live = True
+        includes = list()
+        for name, text in directives:
+            if name in ('if', 'ifdef', 'ifndef'):
+                if live is False:
+                    state = False
+                elif name == 'if':
+                    state = _evaluate(text, macros, changed_macros)
+                    state = None if state is None else bool(state)
+                else:
+                    state = _is_defined(_get_macro_name(text), macros, changed_macros)
+                    if name == 'ifndef' and state is not None:
+                        state = not state
+                branches.append((live, state, state))
+            elif name in ('elif', 'else'):
+                if not branches:
+                    continue
+                parent_live, state, taken = branches[-1]
+                if taken is True or parent_live is False:
+                    state = False
+                else:
+                    if name == 'else':
+                        condition = True
+                    else:
+                        condition = _evaluate(text, macros, changed_macros)
+                        condition = None if condition is None else bool(condition)
+                    if taken is False:
+                        state = condition
+                    else:
+                        state = False if condition is False else None
+                    if condition is True:
+                        taken = True
+                    elif condition is None:
+                        taken = None
+                branches[-1] = (parent_live, state, taken)
+            elif name == 'endif':
+                if branches:
+                    branches.pop()
+            else:
+                if live is not False:
+                    if name in ('define', 'undef'):
+                        changed_macros.add(_get_macro_name(text))
+                    elif name in ('include', 'include_next', 'import'):
+                        include_path = self._resolve(path, is_src, name, text, context, changed_macros)
+                        if include_path is False:
+                            return None
+                        if include_path:
+                            includes.append(include_path)
+                        if name == 'include_next' and is_src:
+                            # gcc takes it as an include in the src, keep both for a header scanned as a src
+                            include_path = self._resolve(path, False, name, text, context, changed_macros)
+                            if include_path:
+                                includes.append(include_path)
+                continue
+            # live is false if any branch is not taken, true if all branches are taken, unknown otherwise
+            live = True
+            for branch in branches:
+                if branch[1] is False:
+                    live = False
+                    break
+                elif branch[1] is None:
+                    live = None
+        return tuple(includes)
+
+    def _resolve(self, path, is_src, directive, text, context, changed_macros):
+        """Return the path of an include, None if not found, False if the include cannot be resolved."""
+        match = _include_pattern.match(text)
+        if not match:
+            # include of a macro
+            value = context[3].get(text.strip())
+            if value is None or text.strip() in changed_macros:
+                return False
+            match = _include_pattern.match(value)
+            if not match:
+                return False
+        quote_dirs, bracket_dirs = context[1], context[2]
+        if match.group(2) is not None:
+            name = match.group(2)
+            search_dirs = quote_dirs + bracket_dirs
+            if directive != 'include_next' or is_src:
+                search_dirs = (get_dir_name(path),) + search_dirs
+        else:
+            name = match.group(1)
+            search_dirs = bracket_dirs
+        if not name:
+            return None
+        if name[0] == '/':
+            return name if self._isfile(name) else None
+        if directive == 'include_next' and not is_src:
+            # search in the dirs after the one the file is found in
+            for i, search_dir in enumerate(search_dirs):
+                if path.startswith(search_dir + '/'):
+                    include_path = self._find(name, search_dirs[(i + 1):])
+                    if include_path:
+                        return include_path
+                    break
+        return self._find(name, search_dirs)
+
+    def _find(self, name, search_dirs):
+        for search_dir in search_dirs:
+            path = join(search_dir, name)
+            if self._isfile(path):
+                return path
+        return None
+
+    def _isfile(self, path):
+        if path not in self._is_file:
+            self._is_file[path] = os.path.isfile(path)
+        return self._is_file[path]
+
+
+def _get_search_dirs(text):
+    search_dirs = list()
+    for line in text.split('\n'):
+        path = line.strip()
+        if path.endswith(' (framework directory)'):
+            continue
+        if path:
+            search_dirs.append(path)
+    return search_dirs
+
+
+def _read_directives(path):
+    """Return the (name, text) of the preprocessing directives in file `path`."""
+    try:
+        with open(path, 'r', errors='surrogateescape') as f:
+            content = f.read()
+    except OSError:
+        return ()
+    content = content.replace('\\\r\n', '').replace('\\\n', '')
+    if '/' in content:
+        # a comment is a space, keep its new lines to keep the lines after it
+        content = _comment_pattern.sub(lambda m: m.group(0) if m.group(0)[0] in '"\'' else
+                                       ('\n' * m.group(0).count('\n') or ' '), content)
+    directives = list()
+    for line in content.split('\n'):
+        if '#' not in line:
+            continue
+        match = _directive_pattern.match(line)
+        if match:
+            directives.append((match.group(1), match.group(2)))
+    return tuple(directives)
+
+
+def _get_macro_name(text):
+    return re.match(r'\s*(\w*)', text).group(1)
+
+
+def _is_defined(name, macros, changed_macros):
+    """Return if macro `name` is defined, None if unknown."""
+    if name in changed_macros or name not in macros:
+        # it may be defined by a header
+        return None
+    return True
+
+
+def _evaluate(text, macros, changed_macros, depth=0):
+    """Return the value of an #if condition, None if unknown."""
+    tokens = list()
+    pos = 0
+    text = text.strip()
+    try:
+        while pos < len(text):
+            match = _token_pattern.match(text, pos)
+            if not match or match.end() == pos:
+                return None
+            pos = match.end()
+            if match.group(1) is not None:
+                number = match.group(1)
+                if number[0] == '0' and len(number) > 1 and number[1] not in 'xX':
+                    tokens.append(('n', int(number, 8)))
+                else:
+                    tokens.append(('n', int(number, 0)))
+            elif match.group(2) is not None:
+                char = match.group(2)[1:-1]
+                tokens.append(('n', ord(char) if len(char) == 1 else None))
+            elif match.group(3) is not None:
+                tokens.append(('i', match.group(3)))
+            else:
+                tokens.append(('o', match.group(4)))
+        parser = _ConditionParser(tokens, macros, changed_macros, depth)
+        value = parser.parse_conditional()
+    except (IndexError, ValueError):
+        return None
+    if parser.pos != len(tokens):
+        return None
+    return value
+
+
+class _ConditionParser(object):
+    """Evaluate the tokens of an #if condition, an unknown value is None."""
+
+    def __init__(self, tokens, macros, changed_macros, depth):
+        self.tokens = tokens
+        self.pos = 0
+        self.macros = macros
+        self.changed_macros = changed_macros
+        self.depth = depth
+
+    def parse_conditional(self):
+        condition = self.parse_binary(0)
+        if self._accept('?'):
+            value_true = self.parse_conditional()
+            self._expect(':')
+            value_false = self.parse_conditional()
+            if condition is None:
+                return value_true if value_true == value_false else None
+            return value_true if condition else value_false
+        return condition
+
+    def parse_binary(self, level):
+        if level == len(_binary_operators):
+            return self.parse_unary()
+        value = self.parse_binary(level + 1)
+        while self.pos < len(self.tokens) and self.tokens[self.pos] in _binary_operators[level]:
+            operator = self.tokens[self.pos][1]
+            self.pos += 1
+            value = _apply_binary(operator, value, self.parse_binary(level + 1))
+        return value
+
+    def parse_unary(self):
+        token = self.tokens[self.pos]
+        self.pos += 1
+        if token[0] == 'n':
+            return token[1]
+        if token[0] == 'o':
+            if token[1] == '(':
+                value = self.parse_conditional()
+                self._expect(')')
+                return value
+            if token[1] in ('!', '~', '-', '+'):
+                value = self.parse_unary()
+                if value is None:
+                    return None
+                if token[1] == '!':
+                    return int(not value)
+                if token[1] == '~':
+                    return ~value
+                return -value if token[1] == '-' else value
+            raise ValueError('unexpected ' + token[1])
+        name = token[1]
+        if name == 'defined':
+            parenthesized = self._accept('(')
+            name = self.tokens[self.pos]
+            self.pos += 1
+            if parenthesized:
+                self._expect(')')
+            if name[0] != 'i':
+                raise ValueError('invalid defined')
+            defined = _is_defined(name[1], self.macros, self.changed_macros)
+            return None if defined is None else int(defined)
+        if self._accept('('):
+            # function-like macros and operators like __has_include
+            depth = 1
+            while depth:
+                token = self.tokens[self.pos]
+                self.pos += 1
+                if token == ('o', '('):
+                    depth += 1
+                elif token == ('o', ')'):
+                    depth -= 1
+            return None
+        value = self.macros.get(name)
+        if value is None or name in self.changed_macros or self.depth >= _MAX_EXPANSION_DEPTH:
+            return None
+        return _evaluate(value, self.macros, self.changed_macros, self.depth + 1)
+
+    def _accept(self, operator):
+        if self.pos < len(self.tokens) and self.tokens[self.pos] == ('o', operator):
+            self.pos += 1
+            return True
+        return False
+
+    def _expect(self, operator):
+        if not self._accept(operator):
+            raise ValueError('expected ' + operator)
+
+
+# binary operators by precedence, lowest first
+_binary_operators = tuple({('o', operator) for operator in operators} for operators in (
+    ('||',), ('&&',), ('|',), ('^',), ('&',), ('==', '!='), ('<', '>', '<=', '>='), ('<<', '>>'), ('+', '-'),
+    ('*', '/', '%')))
+
+
+def _apply_binary(operator, left, right):
+    if operator == '||':
+        if left or right:
+            return 1
+        return None if left is None or right is None else 0
+    if operator == '&&':
+        if left == 0 or right == 0:
+            return 0
+        return None if left is None or right is None else 1
+    if operator == '*' and (left == 0 or right == 0):
+        return 0
+    if left is None or right is None:
+        return None
+    if operator in ('/', '%'):
+        if right == 0:
+            return None
+        # c division truncates toward zero
+        quotient = abs(left) // abs(right)
+        if (left < 0) != (right < 0):
+            quotient = -quotient
+        return quotient if operator == '/' else left - right * quotient
+    if operator in ('<<', '>>'):
+        if not 0 <= right < 64:
+            return None
+        return left << right if operator == '<<' else left >> right
+    if operator == '|':
+        return left | right
+    if operator == '^':
+        return left ^ right
+    if operator == '&':
+        return left & right
+    if operator == '+':
+        return left + right
+    if operator == '-':
+        return left - right
+    if operator == '*':
+        return left * right
+    return int({'==': left == right, '!=': left != right, '<': left < right, '>': left > right,
+                '<=': left <= right, '>=': left >= right}[operator])
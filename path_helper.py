@@ -9,6 +9,9 @@
 
 import os
 
+# max symlinks followed to resolve a path, like linux
+MAX_SYMLINK_HOPS = 40
+
 
 def join(path, name, *paths):
     result = path
@@ -71,22 +74,48 @@ def find_in_paths(name, paths, nocache=False):
     return None
 
 
-def resolve_symlinks(path):
-    path_elements = path.split('/')
-    real_path = ''
-    for element in path_elements:
-        if len(element) == 0:
-            if len(real_path) == 0:
-                real_path = '/'
-            else:
-                continue
-        tmp_path = join(real_path, element)
-        if os.path.islink(tmp_path):
-            tmp_path = join(real_path, os.readlink(tmp_path))
-            # TODO: use linked list to reduce repeated work of this implementation
-            tmp_path = resolve_symlinks(tmp_path)
-        real_path = tmp_path
-    return real_path
+def resolve_symlinks(path, nocache=False):
+    """Get the real path like `readlink -m`, with the symlinks, '.' and '..' in it resolved.
+
+    Each dir is resolved once and cached, the paths in it only resolve their last element.
+    '' is returned for a symlink loop.
+    """
+    global __path_helper__resolve_symlinks_cache
+    if not path:
+        return path
+    if path[0] != '/':
+        path = join(os.getcwd(), path)
+    if nocache:
+        return _resolve_symlinks(path, dict(), 0)
+    if '__path_helper__resolve_symlinks_cache' not in globals():
+        __path_helper__resolve_symlinks_cache = dict()
+    return _resolve_symlinks(path, __path_helper__resolve_symlinks_cache, 0)
+
+
+def _resolve_symlinks(path, cache, hops):
+    result = cache.get(path)
+    if result is not None:
+        return result
+    pos = path.rfind('/')
+    name = path[(pos + 1):]
+    real_dir = '/'
+    if pos > 0:
+        real_dir = _resolve_symlinks(path[:pos], cache, hops)
+        if not real_dir:
+            return real_dir
+    if not name or name == '.':
+        result = real_dir
+    elif name == '..':
+        result = real_dir[:real_dir.rfind('/')] or '/'
+    else:
+        result = join(real_dir, name)
+        if os.path.islink(result):
+            if hops >= MAX_SYMLINK_HOPS:
+                return ''
+            result = _resolve_symlinks(join(real_dir, os.readlink(result)), cache, hops + 1)
+    if result:
+        cache[path] = result
+    return result
 
 
 def get_base_name(path):
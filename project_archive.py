@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+
+##
+# Copyright (c) Nokia 2018. All rights reserved.
+#
+# Author: 
+# Email: nokia-sbell.com
+#
+
+import io
+import os
+import gzip
+import lzma
+import time
+import errno
+import fcntl
+import shutil
+import hashlib
+import tarfile
+import collections
+import multiprocessing
+import multiprocessing.pool
+
+from path_helper import join, get_dir_name, get_relative_path
+
+# how the files are staged: copied, copied by reflinks where the fs supports them, hard linked or symlinked
+STAGE_MODES = ('copy', 'reflink', 'hardlink', 'symlink')
+STAGE_THREAD_COUNT = 16
+# files staged by one job
+STAGE_CHUNK_SIZE = 256
+# compression -> (default level, archive extension)
+COMPRESSIONS = {'xz': (6, '.txz'), 'gz': (6, '.tgz')}
+# bytes of the archive compressed into one stream
+COMPRESS_BLOCK_SIZE = 32 << 20
+# bytes of a file hashed at a time
+HASH_BLOCK_SIZE = 1 << 20
+# file of a delta archive listing the files to delete, one project path per line
+DELETED_LIST_NAME = '.deleted-files'
+# ioctl of linux/fs.h to clone a file
+_FICLONE = 0x40049409
+# errors of a reflink or hard link which the fs or the paths do not support
+_LINK_ERRORS = (errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EPERM, errno.EMLINK)
+# errors of a kernel copy which the fs or the kernel do not support
+_COPY_ERRORS = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF)
+# max bytes copied by one kernel copy call
+_COPY_SIZE = 1 << 30
+
+
+def stage_files(file_list, root, tmp_dir, mode='copy'):
+    """Stage the files of `file_list` in `root` into `tmp_dir` at the same relative paths, see `STAGE_MODES`.
+
+    The dirs are created in one sorted pass, the files are staged by a pool of threads. Copies keep the
+    mode and timestamps of the files like `cp -p`.
+    """
+    if mode not in STAGE_MODES:
+        raise ValueError('unknown stage mode: ' + mode)
+    print('Creating dirs', flush=True, end='')
+    dir_set = set()
+    job_list = list()
+    for path in file_list:
+        rpath = get_relative_path(root, path)
+        if not rpath:
+            continue
+        dir_set.add(get_dir_name(join(tmp_dir, rpath)))
+        job_list.append((path, join(tmp_dir, rpath)))
+    # parents are sorted before their sub dirs
+    for path in sorted(dir_set):
+        os.makedirs(path, exist_ok=True)
+    print(' {:d} ok\nStaging files'.format(len(dir_set)), flush=True, end='')
+    stage_file = globals()['_stage_' + mode]
+    chunks = [(stage_file, job_list[i:(i + STAGE_CHUNK_SIZE)]) for i in range(0, len(job_list), STAGE_CHUNK_SIZE)]
+    with multiprocessing.pool.ThreadPool(processes=STAGE_THREAD_COUNT) as pool:
+        for output in pool.imap_unordered(_worker_stage_files, chunks):
+            print(output, flush=True, end='')
+    print(' {:d} ok'.format(len(job_list)), flush=True)
+
+
+def parse_compression(text):
+    """Return the (compression, level) of a `<compression>[:<level>]` text, None if it is not valid."""
+    compression, _, level = text.partition(':')
+    if compression not in COMPRESSIONS:
+        return None
+    if not level:
+        return compression, COMPRESSIONS[compression][0]
+    if not level.isdigit() or not 0 <= int(level) <= 9:
+        return None
+    return compression, int(level)
+
+
+def get_archive_path(tmp_dir, compression=('xz', 6), delta=False):
+    name = os.path.basename(tmp_dir.rstrip('/'))
+    if delta:
+        name += '-delta'
+    return name + COMPRESSIONS[compression[0]][1]
+
+
+def get_manifest_path(tmp_dir):
+    return os.path.basename(tmp_dir.rstrip('/')) + '.manifest'
+
+
+def write_archive(archive_path, file_list, root, tmp_dir, compression=('xz', 6), dereference=False,
+                  prev_manifest=None, processes=None):
+    """Write the project archive from `tmp_dir` and the files of `file_list` in `root` without staging them.
+
+    The files are named as if they were staged into `tmp_dir` and archived by `tar cJf`. The archive
+    is compressed in blocks of COMPRESS_BLOCK_SIZE by a pool of `processes`, the cpu count by default,
+    see `_BlockCompressor`. `dereference` archives the files the symlinks in `tmp_dir` point to.
+
+    Return the manifest of the project, see `load_manifest`. Given the manifest of a previous archive
+    in `prev_manifest`, only the files changed or added since it are archived, with the list of the
+    files deleted since it in DELETED_LIST_NAME. scripts/apply-project-delta applies such an archive.
+    """
+    print('Archiving project', flush=True, end='')
+    base_name = tmp_dir.lstrip('/')
+    # (path in the project, path of the file, path of the dir the project path is relative to)
+    file_jobs = list()
+    for dir_path, dir_names, file_names in os.walk(tmp_dir, followlinks=dereference):
+        dir_names.sort()
+        for file_name in sorted(file_names):
+            path = join(dir_path, file_name)
+            file_jobs.append((get_relative_path(tmp_dir, path), path, tmp_dir))
+    for path in file_list:
+        rpath = get_relative_path(root, path)
+        if rpath:
+            file_jobs.append((rpath, path, root))
+    manifest = dict()
+    count = 0
+    processes = processes or multiprocessing.cpu_count()
+    with open(archive_path, 'wb') as archive_file, \
+            multiprocessing.Pool(processes=processes) as pool, \
+            _BlockCompressor(archive_file, compression, pool, processes) as compressor, \
+            tarfile.open(fileobj=compressor, mode='w|', dereference=dereference) as tar:
+        tar.addfile(tar.gettarinfo(tmp_dir, base_name))
+        dir_set = set()
+        for rpath, path, rpath_root in file_jobs:
+            if rpath in manifest:
+                continue
+            info = tar.gettarinfo(path, join(base_name, rpath))
+            if not info.isreg():
+                continue
+            # a file of another size has changed, it is hashed while archived
+            prev_entry = prev_manifest.get(rpath) if prev_manifest is not None else None
+            if prev_entry is not None and prev_entry[0] == info.size:
+                manifest[rpath] = (info.size, _hash_file(path))
+                if prev_entry == manifest[rpath]:
+                    continue
+            # the dirs before their files
+            dir_paths = list()
+            dir_path = rpath[:max(rpath.rfind('/'), 0)]
+            while dir_path and dir_path not in dir_set:
+                dir_paths.append(dir_path)
+                dir_path = dir_path[:max(dir_path.rfind('/'), 0)]
+            for dir_path in reversed(dir_paths):
+                tar.addfile(tar.gettarinfo(join(rpath_root, dir_path), join(base_name, dir_path)))
+                dir_set.add(dir_path)
+            with open(path, 'rb') as f:
+                reader = _HashReader(f)
+                tar.addfile(info, reader)
+            manifest[rpath] = (info.size, reader.hash.hexdigest())
+            count += 1
+            if count % STAGE_CHUNK_SIZE == 0:
+                print('.', flush=True, end='')
+        if prev_manifest is not None:
+            deleted = ''.join(rpath + '\n' for rpath in sorted(prev_manifest.keys()) if rpath not in manifest)
+            data = deleted.encode('utf-8', 'surrogateescape')
+            info = tarfile.TarInfo(join(base_name, DELETED_LIST_NAME))
+            info.size = len(data)
+            info.mtime = int(time.time())
+            tar.addfile(info, io.BytesIO(data))
+            print(' {:d} deleted'.format(deleted.count('\n')), flush=True, end='')
+    print(' {:d} ok'.format(count), flush=True)
+    return manifest
+
+
+def load_manifest(path):
+    """Return the manifest written by `save_manifest`, project path -> (size, sha256 of the file)."""
+    manifest = dict()
+    with open(path, 'r', errors='surrogateescape') as f:
+        for line in f:
+            items = line.rstrip('\n').split(' ', 2)
+            if len(items) == 3:
+                manifest[items[2]] = (int(items[1]), items[0])
+    return manifest
+
+
+def save_manifest(path, manifest):
+    with open(path, 'w', errors='surrogateescape') as f:
+        for rpath in sorted(manifest.keys()):
+            f.write('{:s} {:d} {:s}\n'.format(manifest[rpath][1], manifest[rpath][0], rpath))
+
+
+def _hash_file(path):
+    file_hash = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for data in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            file_hash.update(data)
+    return file_hash.hexdigest()
+
+
+class _HashReader(object):
+    """A file hashing the data read from it."""
+
+    def __init__(self, f):
+        self._file = f
+        self.hash = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self._file.read(size)
+        self.hash.update(data)
+        return data
+
+
+class _BlockCompressor(object):
+    """A file compressing the data written to it in blocks, by a pool of processes.
+
+    Each block is compressed into a stream of its own and the streams are written in order, xz and
+    gzip read the concatenated streams as one file.
+    """
+
+    def __init__(self, f, compression, pool, processes):
+        self._file = f
+        self._compression = compression
+        self._pool = pool
+        self._buffer = bytearray()
+        self._pending = collections.deque()
+        # blocks compressing or waiting, to bound the memory used, by the processes of the pool
+        self._max_pending = 2 * processes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+    def write(self, data):
+        self._buffer += data
+        while len(self._buffer) >= COMPRESS_BLOCK_SIZE:
+            self._compress(bytes(self._buffer[:COMPRESS_BLOCK_SIZE]))
+            del self._buffer[:COMPRESS_BLOCK_SIZE]
+        return len(data)
+
+    def close(self):
+        if self._buffer or not self._pending:
+            self._compress(bytes(self._buffer))
+            self._buffer.clear()
+        while self._pending:
+            self._file.write(self._pending.popleft().get())
+
+    def _compress(self, block):
+        self._pending.append(self._pool.apply_async(_compress_block, ((self._compression, block),)))
+        while len(self._pending) > self._max_pending:
+            self._file.write(self._pending.popleft().get())
+
+
+def _compress_block(job):
+    (compression, level), block = job
+    if compression == 'gz':
+        return gzip.compress(block, compresslevel=level, mtime=0)
+    return lzma.compress(block, format=lzma.FORMAT_XZ, preset=level)
+
+
+def _worker_stage_files(job):
+    stage_file, jobs = job
+    for src, dst in jobs:
+        stage_file(src, dst)
+    return '.'
+
+
+def _stage_copy(src, dst):
+    with open(src, 'rb', buffering=0) as src_file, open(dst, 'wb', buffering=0) as dst_file:
+        _copy_data(src_file, dst_file)
+    shutil.copystat(src, dst)
+
+
+def _stage_reflink(src, dst):
+    with open(src, 'rb', buffering=0) as src_file, open(dst, 'wb', buffering=0) as dst_file:
+        try:
+            fcntl.ioctl(dst_file.fileno(), _FICLONE, src_file.fileno())
+        except OSError as e:
+            if e.errno not in _LINK_ERRORS:
+                raise
+            _copy_data(src_file, dst_file)
+    shutil.copystat(src, dst)
+
+
+def _stage_hardlink(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError as e:
+        if e.errno not in _LINK_ERRORS:
+            raise
+        _stage_copy(src, dst)
+
+
+def _stage_symlink(src, dst):
+    os.symlink(src, dst)
+
+
+def _copy_data(src_file, dst_file):
+    """Copy the data of `src_file` to `dst_file` in the kernel if possible, by copy_file_range or sendfile."""
+    src_fd = src_file.fileno()
+    dst_fd = dst_file.fileno()
+    for copy in _kernel_copies:
+        try:
+            while copy(src_fd, dst_fd, _COPY_SIZE):
+                pass
+            return
+        except OSError as e:
+            # retried only if nothing is copied
+            if e.errno not in _COPY_ERRORS or os.lseek(dst_fd, 0, os.SEEK_CUR):
+                raise
+    shutil.copyfileobj(src_file, dst_file)
+
+
+def _sendfile(src_fd, dst_fd, count):
+    return os.sendfile(dst_fd, src_fd, None, count)
+
+
+_kernel_copies = [copy for copy in (getattr(os, 'copy_file_range', None), _sendfile) if copy]
@@ -21,7 +21,7 @@ source L2-HI/set_build_env.sh build_asik
 cd ../..
 rm fs.snapshot
 fs-snapshot fs.snapshot gnb
-rm command_hook.jsonlogs
+rm -rf command_hook.jsonlogs
 cd gnb/uplane
 
 # build l2hi code
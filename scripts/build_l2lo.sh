@@ -21,7 +21,7 @@ source L2-LO/setup.sh --target=asik-x86_64-ps_lfs
 cd ../..
 rm fs.snapshot
 fs-snapshot fs.snapshot gnb
-rm command_hook.jsonlogs
+rm -rf command_hook.jsonlogs
 cd gnb/uplane
 
 # build l2lo code
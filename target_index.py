@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+##
+# Copyright (c) Nokia 2018. All rights reserved.
+#
+# Author: 
+# Email: nokia-sbell.com
+#
+
+import pygtrie
+
+from path_helper import get_base_name
+
+
+class TargetIndex(object):
+    """Index of the outputs of a dependency tree by base name, in the order they are added."""
+
+    def __init__(self):
+        # reversed base name -> base name, to find the base names ending with a name
+        self._base_names = pygtrie.CharTrie()
+        # base name -> [(order added, (path, version))]
+        self._targets = dict()
+        # base name -> (path, version) of the latest version
+        self._latest_targets = dict()
+        self._count = 0
+
+    def add(self, target):
+        base_name = get_base_name(target[0])
+        targets = self._targets.get(base_name)
+        if targets is None:
+            targets = list()
+            self._targets[base_name] = targets
+            self._base_names[base_name[::-1]] = base_name
+        targets.append((self._count, target))
+        self._count += 1
+        latest_target = self._latest_targets.get(base_name)
+        if latest_target is None or latest_target[1] < target[1]:
+            self._latest_targets[base_name] = target
+
+    def find(self, name, version=-1):
+        """Return the target whose path ends with `name`, None if not found.
+
+        The last added one is returned if `version` is -1, otherwise the first added one of `version`.
+        """
+        pos = name.rfind('/')
+        if pos >= 0:
+            # the name has dirs, the base name must be all of its last element
+            base_names = (name[(pos + 1):],)
+        elif self._base_names.has_node(name[::-1]):
+            base_names = self._base_names.values(prefix=name[::-1])
+        else:
+            return None
+        target_id = None
+        for base_name in base_names:
+            for order, target in self._targets.get(base_name, ()):
+                if not target[0].endswith(name):
+                    continue
+                if version == -1:
+                    if target_id is None or target_id[0] < order:
+                        target_id = (order, target)
+                elif target[1] == version:
+                    if target_id is None or order < target_id[0]:
+                        target_id = (order, target)
+                    break
+        if target_id is None:
+            return None
+        return target_id[1]
+
+    def find_latest(self, base_name):
+        """Return the target of base name `base_name` with the latest version, None if not found."""
+        return self._latest_targets.get(base_name)
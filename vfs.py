@@ -7,7 +7,7 @@
 # Email: nokia-sbell.com
 #
 
-import copy
+import sys
 
 from path_helper import join, get_abs_path
 
@@ -15,11 +15,20 @@ VFS_FILE = 1
 VFS_SYMLINK = 2
 VFS_DIR = 4
 
+# max symlinks followed to resolve a path, like ELOOP of linux
+MAX_SYMLINK_HOPS = 40
+
+# children of a node without any
+_no_children = dict()
+
 
 class VFs(object):
     def __init__(self):
         self._root = Node()
         self._root.values.append(VDir(self._root, 0, 0))
+        # abs dir path -> (dir node, symlink nodes followed), and the paths depending on each node to drop on rm
+        self._resolved_dirs = dict()
+        self._resolved_dir_paths = dict()
 
     def exist(self, path):
         try:
@@ -195,8 +204,8 @@ class VFs(object):
                 raise FileTypeNotMatch('dst file {:s} type {:s} is not file.'.format(dst,
                                                                                      _type_to_string(dst_file.type)))
         dst_file = self._get_file(dst, VFS_FILE, True, True, False)
-        if src_file.extra_data_ref.value:
-            dst_file.extra_data_ref.value = copy.deepcopy(src_file.extra_data_ref.value)
+        if src_file.extra_data_ref is not None and src_file.extra_data_ref.value:
+            _get_extra_data_ref(dst_file).value = src_file.extra_data_ref.value.copy()
         if src_file.copy_src:
             dst_file.copy_src = src_file.copy_src
         else:
@@ -225,6 +234,8 @@ class VFs(object):
         if node == self._root:
             raise ValueError('root dir cannot be removed.')
         node.exist = False
+        for resolved_path in self._resolved_dir_paths.pop(node, ()):
+            self._resolved_dirs.pop(resolved_path, None)
         for child in node.children.keys():
             next_node = node.children[child]
             if not next_node.exist:
@@ -232,28 +243,146 @@ class VFs(object):
             self._del_tree(next_node)
 
     def _get_file(self, path, file_type, create, overwrite, create_dirs, override_to_dir=False):
-        ptr_node = self._root
-        abs_path = get_abs_path(path)
-        if abs_path == '/':
-            if file_type & VFS_DIR:
-                if create and overwrite:
-                    raise FileExist('file {:s} exists.'.format(abs_path))
+        hops = 0
+        while True:
+            if hops > MAX_SYMLINK_HOPS:
+                raise SymlinkLoop('too many levels of symbolic links in {:s}'.format(path))
+            abs_path = get_abs_path(path)
+            if abs_path == '/':
+                if file_type & VFS_DIR:
+                    if create and overwrite:
+                        raise FileExist('file {:s} exists.'.format(abs_path))
+                    else:
+                        return self._root.values[-1]
+                else:
+                    raise FileTypeNotMatch('{:s} file type {:s} not match {:s}'.format(abs_path,
+                                                                                       _type_to_string(
+                                                                                           self._root.values[-1].type),
+                                                                                       _type_to_string(file_type)))
+            if not abs_path.startswith('/'):
+                raise ValueError('path `{:s}` not absolute or not valid'.format(abs_path))
+            path_elements = abs_path.split('/')
+            ptr_node = self._resolve_dir(abs_path[:abs_path.rfind('/')], create_dirs, override_to_dir)[0]
+            # try get file in target dir
+            file = path_elements[-1]
+            abs_path = join(ptr_node.path, file)
+            current_dir = ptr_node.values[-1]
+            # if file node is exist
+            if file in ptr_node.children:
+                file_node = ptr_node.children[file]
+                file_value = file_node.values[-1]
+                # if file is exist
+                if file_node.exist:
+                    current_file = file_node.values[-1]
+                    # if we should overwrite current file
+                    if create and overwrite:
+                        # if current is file and overwrite type is file
+                        if file_type == VFS_FILE and current_file.type == VFS_FILE:
+                            # create a new file
+                            file_value = VFile(file_node, len(file_node.values), current_dir.version)
+                            file_node.values.append(file_value)
+                        # - current is symlink and overwrite type is not symlink
+                        elif not file_type & VFS_SYMLINK and current_file.type == VFS_SYMLINK:
+                            target = join(ptr_node.path, file_value.target)
+                            # if symlink to itself
+                            if target == abs_path:
+                                raise PathNotExist('path {:s} is not exist.'.format(abs_path))
+                            # follow symlink, a followed symlink does not override files to dirs
+                            path = target
+                            hops += 1
+                            override_to_dir = False
+                            continue
+                        # - current is symlink and overwrite type is symlink
+                        # - current is file and overwrite type is not file
+                        # - current is dir and try to overwrite
+                        else:
+                            raise FileExist('file {:s} exists.'.format(abs_path))
+                    # - current is symlink and create not overwrite
+                    elif create and current_file.type == VFS_SYMLINK:
+                        target = join(ptr_node.path, file_value.target)
+                        # if symlink to itself
+                        if target == abs_path:
+                            raise PathNotExist('path {:s} is not exist.'.format(abs_path))
+                        # follow symlink, a followed symlink does not override files to dirs
+                        path = target
+                        hops += 1
+                        override_to_dir = False
+                        continue
+                    # if file is what we want
+                    if file_value.type & file_type:
+                        return file_value
+                    # - file is symlink
+                    elif file_value.type == VFS_SYMLINK:
+                        target = join(ptr_node.path, file_value.target)
+                        # if symlink to itself
+                        if target == abs_path:
+                            raise PathNotExist('path {:s} is not exist.'.format(abs_path))
+                        # follow symlink, a followed symlink does not override files to dirs
+                        path = target
+                        hops += 1
+                        override_to_dir = False
+                        continue
+                    # - error: file type not match
+                    else:
+                        raise FileTypeNotMatch('{:s} file type {:s} not match {:s}'.format(abs_path,
+                                                                                           _type_to_string(file_value.type),
+                                                                                           _type_to_string(file_type)))
+                # - file is not exist
                 else:
-                    return self._root.values[-1]
+                    # if we will create it
+                    if create:
+                        # create a new file
+                        file_value = _create_file(file_type, file_node, len(file_node.values), current_dir.version)
+                        file_node.values.append(file_value)
+                        file_node.exist = True
+                        return file_value
+                    # - error: path not exist
+                    else:
+                        raise PathNotExist('path {:s} is not exist.'.format(join(ptr_node.path, file)))
+            # - file node is not exist but we will create it
+            elif create:
+                # create new file node and add to current node
+                file_node = Node(ptr_node, file)
+                ptr_node.add_child(file_node)
+                # create new file for item node
+                file_value = _create_file(file_type, file_node, 0, current_dir.version)
+                file_node.values.append(file_value)
+                return file_value
+            # - error: path not exist
             else:
-                raise FileTypeNotMatch('{:s} file type {:s} not match {:s}'.format(abs_path,
-                                                                                   _type_to_string(
-                                                                                       self._root.values[-1].type),
-                                                                                   _type_to_string(file_type)))
-        if not abs_path.startswith('/'):
-            raise ValueError('path `{:s}` not absolute or not valid'.format(abs_path))
-        path_elements = abs_path.split('/')
-        # loop through dirs
-        element_count = 0
-        for item in path_elements[:-1]:
-            element_count += 1
-            if not item:
+                raise PathNotExist('path {:s} is not exist.'.format(join(ptr_node.path, file)))
+
+    def _resolve_dir(self, dir_path, create_dirs, override_to_dir):
+        """Return (dir node, symlink nodes followed) of `dir_path`, symlinks in the path are followed.
+
+        The walk of a path waits on a stack while the target of a symlink in it is walked, at most
+        MAX_SYMLINK_HOPS symlinks are followed. Each dir path and each followed symlink path is cached
+        with the node it resolves to, until one of the nodes it depends on is removed.
+        """
+        resolved = self._resolved_dirs.get(dir_path)
+        if resolved is not None:
+            return resolved
+        stack = list()
+        hops = 0
+        elements = dir_path.split('/')
+        index = 1
+        ptr_node = self._root
+        symlinks = list()
+        while True:
+            # walk finished
+            if index >= len(elements):
+                self._cache_resolved_dir('/'.join(elements), ptr_node, symlinks)
+                if not stack:
+                    return ptr_node, tuple(symlinks)
+                # continue the walk of the path the symlink is in
+                target_symlinks = symlinks
+                elements, index, symlinks, link_node = stack.pop()
+                symlinks.append(link_node)
+                symlinks.extend(target_symlinks)
+                self._cache_resolved_dir('/'.join(elements[:(index + 1)]), ptr_node, symlinks)
+                index += 1
                 continue
+            item = elements[index]
             # 1. current node exists
             # 2. current node is dir
             current_dir = ptr_node.values[-1]
@@ -265,7 +394,6 @@ class VFs(object):
                 if item_node.exist and item_file.type == VFS_DIR:
                     # move to dir
                     ptr_node = item_node
-                    continue
                 # - item not exists
                 elif not item_node.exist:
                     # if we will create it
@@ -275,18 +403,36 @@ class VFs(object):
                         item_node.exist = True
                         # move to dir
                         ptr_node = item_node
-                        continue
                     # - error: path not exist
                     else:
                         raise PathNotExist('path {:s} is not exist.'.format(join(ptr_node.path, item)))
                 # - item exists and is symlink
                 elif item_file.type == VFS_SYMLINK:
-                    target = join(ptr_node.path, item_file.target, *path_elements[element_count:])
-                    # if symlink to itself
-                    if target == abs_path:
-                        raise PathNotExist('path {:s} is not exist.'.format(join(ptr_node.path, item)))
-                    # follow symlink
-                    return self._get_file(target, file_type, create, overwrite, create_dirs)
+                    # a followed symlink does not override files to dirs
+                    override_to_dir = False
+                    resolved = self._resolved_dirs.get('/'.join(elements[:(index + 1)]))
+                    # symlink already followed
+                    if resolved is not None:
+                        ptr_node = resolved[0]
+                        symlinks.extend(resolved[1])
+                        index += 1
+                        continue
+                    hops += 1
+                    if hops > MAX_SYMLINK_HOPS:
+                        raise SymlinkLoop('too many levels of symbolic links in {:s}'.format(dir_path))
+                    # walk the target of the symlink
+                    stack.append((elements, index, symlinks, item_node))
+                    target = _get_symlink_target_path(item_file)
+                    elements = target.split('/') if target != '/' else ['']
+                    index = 1
+                    ptr_node = self._root
+                    symlinks = list()
+                    resolved = self._resolved_dirs.get('/'.join(elements))
+                    if resolved is not None:
+                        ptr_node = resolved[0]
+                        symlinks.extend(resolved[1])
+                        index = len(elements)
+                    continue
                 # - error: item exists but is not dir or symlink
                 else:
                     # if override to dir
@@ -294,162 +440,112 @@ class VFs(object):
                         item_node.values.append(VDir(item_node, len(item_node.values), current_dir.version))
                         # move to dir
                         ptr_node = item_node
-                        continue
-                    raise PathNotExist('{:s} is not a dir.'.format(item_node.path))
+                    else:
+                        raise PathNotExist('{:s} is not a dir.'.format(item_node.path))
             # - item node is not exist but we will create it
             elif create_dirs:
                 # create new dir node and add to current node
                 item_node = Node(ptr_node, item)
-                ptr_node.children[item] = item_node
+                ptr_node.add_child(item_node)
                 # create VDir for item node
                 item_node.values.append(VDir(item_node, 0, current_dir.version))
                 # move to dir
                 ptr_node = item_node
-                continue
             # - error: path not exist
             else:
                 raise PathNotExist('path {:s} is not exist.'.format(join(ptr_node.path, item)))
-        # try get file in target dir
-        file = path_elements[-1]
-        current_dir = ptr_node.values[-1]
-        # if file node is exist
-        if file in ptr_node.children:
-            file_node = ptr_node.children[file]
-            file_value = file_node.values[-1]
-            # if file is exist
-            if file_node.exist:
-                current_file = file_node.values[-1]
-                # if we should overwrite current file
-                if create and overwrite:
-                    # if current is file and overwrite type is file
-                    if file_type == VFS_FILE and current_file.type == VFS_FILE:
-                        # create a new file
-                        file_value = VFile(file_node, len(file_node.values), current_dir.version)
-                        file_node.values.append(file_value)
-                    # - current is symlink and overwrite type is not symlink
-                    elif not file_type & VFS_SYMLINK and current_file.type == VFS_SYMLINK:
-                        target = join(ptr_node.path, file_value.target)
-                        # if symlink to itself
-                        if target == abs_path:
-                            raise PathNotExist('path {:s} is not exist.'.format(abs_path))
-                        # follow symlink
-                        return self._get_file(target, file_type, create, overwrite, create_dirs)
-                    # - current is symlink and overwrite type is symlink
-                    # - current is file and overwrite type is not file
-                    # - current is dir and try to overwrite
-                    else:
-                        raise FileExist('file {:s} exists.'.format(abs_path))
-                # - current is symlink and create not overwrite
-                elif create and current_file.type == VFS_SYMLINK:
-                    target = join(ptr_node.path, file_value.target)
-                    # if symlink to itself
-                    if target == abs_path:
-                        raise PathNotExist('path {:s} is not exist.'.format(abs_path))
-                    # follow symlink
-                    return self._get_file(target, file_type, create, overwrite, create_dirs)
-                # if file is what we want
-                if file_value.type & file_type:
-                    return file_value
-                # - file is symlink
-                elif file_value.type == VFS_SYMLINK:
-                    target = join(ptr_node.path, file_value.target)
-                    # if symlink to itself
-                    if target == abs_path:
-                        raise PathNotExist('path {:s} is not exist.'.format(abs_path))
-                    # follow symlink
-                    return self._get_file(target, file_type, create, overwrite, create_dirs)
-                # - error: file type not match
-                else:
-                    raise FileTypeNotMatch('{:s} file type {:s} not match {:s}'.format(abs_path,
-                                                                                       _type_to_string(file_value.type),
-                                                                                       _type_to_string(file_type)))
-            # - file is not exist
-            else:
-                # if we will create it
-                if create:
-                    # create a new file
-                    file_value = _create_file(file_type, file_node, len(file_node.values), current_dir.version)
-                    file_node.values.append(file_value)
-                    file_node.exist = True
-                    return file_value
-                # - error: path not exist
-                else:
-                    raise PathNotExist('path {:s} is not exist.'.format(join(ptr_node.path, file)))
-        # - file node is not exist but we will create it
-        elif create:
-            # create new file node and add to current node
-            file_node = Node(ptr_node, file)
-            ptr_node.children[file] = file_node
-            # create new file for item node
-            file_value = _create_file(file_type, file_node, 0, current_dir.version)
-            file_node.values.append(file_value)
-            return file_value
-        # - error: path not exist
-        else:
-            raise PathNotExist('path {:s} is not exist.'.format(join(ptr_node.path, file)))
+            index += 1
+
+    def _cache_resolved_dir(self, dir_path, node, symlinks):
+        if dir_path in self._resolved_dirs:
+            return
+        # every node on the path is an existing dir or symlink now, it changes only if one of them is removed
+        self._resolved_dirs[dir_path] = (node, tuple(symlinks))
+        self._resolved_dir_paths.setdefault(node, list()).append(dir_path)
+        for link_node in symlinks:
+            self._resolved_dir_paths.setdefault(link_node, list()).append(dir_path)
 
 
 class Node(object):
+    __slots__ = ('values', 'exist', 'parent', 'children', 'name')
+
     def __init__(self, parent=None, name='/'):
         self.values = list()
         self.exist = True
         self.parent = parent
-        self.children = dict()
-        self.name = name
-        self.path = '/'
-        if parent:
-            if parent.path == '/':
-                self.path = '/' + name
-            else:
-                self.path = parent.path + '/' + name
+        # empty until the first child is added, see `add_child`
+        self.children = _no_children
+        self.name = sys.intern(name)
+
+    @property
+    def path(self):
+        if self.parent is None:
+            return '/'
+        names = list()
+        node = self
+        while node.parent is not None:
+            names.append(node.name)
+            node = node.parent
+        names.reverse()
+        return '/' + '/'.join(names)
+
+    def add_child(self, node):
+        # an empty dict may be shared by many nodes, never add to it
+        if not self.children:
+            self.children = dict()
+        self.children[node.name] = node
 
 
 class VDir(object):
+    __slots__ = ('node', 'version', 'parent_version', 'extra_data_ref', 'copy_src')
+    type = VFS_DIR
+
     def __init__(self, node, version, parent_version, extra_data_ref=None):
-        self.type = VFS_DIR
         self.node = node
         self.version = version
         self.parent_version = parent_version
-        # data
+        # data, the ref is created on first use, see `_get_extra_data_ref`
         self.extra_data_ref = extra_data_ref
-        if self.extra_data_ref is None:
-            self.extra_data_ref = Ref()
         self.copy_src = None
 
 
 class VFile(object):
+    __slots__ = ('node', 'version', 'parent_version', 'extra_data_ref', 'copy_src')
+    type = VFS_FILE
+
     def __init__(self, node, version, parent_version, extra_data_ref=None):
-        self.type = VFS_FILE
         self.node = node
         self.version = version
         self.parent_version = parent_version
-        # data
+        # data, the ref is created on first use, see `_get_extra_data_ref`
         self.extra_data_ref = extra_data_ref
-        if self.extra_data_ref is None:
-            self.extra_data_ref = Ref()
         self.copy_src = None
 
 
 class VSymlink(object):
+    __slots__ = ('node', 'version', 'parent_version', 'target', 'target_path', 'extra_data_ref', 'copy_src')
+    type = VFS_SYMLINK
+
     def __init__(self, node, version, parent_version, extra_data_ref=None):
-        self.type = VFS_SYMLINK
         self.node = node
         self.version = version
         self.parent_version = parent_version
-        # data
+        # data, the ref is created on first use, see `_get_extra_data_ref`
         self.target = None
+        # abs path of target, see `_get_symlink_target_path`
+        self.target_path = None
         self.extra_data_ref = extra_data_ref
-        if self.extra_data_ref is None:
-            self.extra_data_ref = Ref()
         self.copy_src = None
 
 
 class VFileHandler(object):
+    __slots__ = ('__file',)
+
     def __init__(self, file):
         self.__file = file
 
     def get_extra_data_ref(self):
-        return self.__file.extra_data_ref
+        return _get_extra_data_ref(self.__file)
 
     def get_version(self):
         return self.__file.version
@@ -471,10 +567,25 @@ class VFileHandler(object):
 
 
 class Ref(object):
+    __slots__ = ('value',)
+
     def __init__(self, value=None):
         self.value = value
 
 
+def _get_extra_data_ref(file):
+    if file.extra_data_ref is None:
+        file.extra_data_ref = Ref()
+    return file.extra_data_ref
+
+
+def _get_symlink_target_path(link):
+    if link.target_path is None:
+        # the abs path of root is empty
+        link.target_path = get_abs_path(join(link.node.parent.path, link.target)) or '/'
+    return link.target_path
+
+
 def _create_file(file_type, node, version, parent_version):
     if file_type & VFS_FILE:
         return VFile(node, version, parent_version)
@@ -501,6 +612,10 @@ class PathNotExist(Exception):
     pass
 
 
+class SymlinkLoop(PathNotExist):
+    pass
+
+
 class FileExist(Exception):
     pass
 